@@ -10,6 +10,12 @@ WARNINGS:
 Features:
     -supports lists, ranges and dictionaries
     -tries to guess some basic types
+    -non-interactive loading (interactive=False): missing values are taken from the
+     overrides (ex: from the command line, "name=value"), then from the environment
+     (env_prefix + name), then from the default. If some are still missing, a
+     ValueError with all of them is raised. Nothing is printed unless verbose is set.
+    -parsed files are cached (by path and modification time), loading the same file
+     again does not parse it again
 
 TESTS:
     -example.cfg contains basic tests for the implemented types:
@@ -30,11 +36,17 @@ Changelog:
                 - added dynamic calling of user define functions
                 - added autocompletion of filenames
                 - changed the dictionaries to OrderedDict (so items keep their order)
+    19.10.2026  - added non-interactive loading (overrides, environment), readline is
+                  only imported when reading from the user, cache of parsed files
 '''
 import yaml
-import readline
 import glob
 import collections
+import copy
+import os
+
+#Parsed files: (path, modification time, size, class) -> (values, defaults, types)
+_parsed = {}
 
 #See experimental folder for source
 def complete(text, state):
@@ -44,20 +56,98 @@ def uncomplete(text, state):
     return None
 
 class Config():
-    def __init__(self, config_file=None, user_variables=None, custom_types=None):
+    def __init__(self, config_file=None, user_variables=None, custom_types=None,
+                 interactive=True, overrides=None, env_prefix=None, verbose=None):
+        if verbose is None:
+            verbose = interactive
+
         #
-        ## Parse and close the file
+        ## Parse the file (or take it from the cache)
         #
-        if config_file is not None:
-            cfgFile = open(config_file, "r")
-            parsedData = list(yaml.safe_load_all(cfgFile))[0]
-            cfgFile.close()
-        else:
-            parsedData = []
+        var_val, var_def, var_typ = self.parseFile(config_file)
+
+        #Append the user variables
+        if user_variables is not None:
+            for var in user_variables:
+                var_val[var[0]] = None
+                var_typ[var[0]] = var[1]
+                var_def[var[0]] = var[2]
+
+        #
+        ## Overrides win over the file, the environment only fills in missing values
+        #
+        if overrides is not None:
+            if not isinstance(overrides, dict):
+                overrides = dict(elem.split("=", 1) for elem in overrides)
+            for varName in overrides:
+                var_val[varName] = self.createVar(var_typ.get(varName), overrides[varName])
+                var_def.setdefault(varName, None)
+                var_typ.setdefault(varName, None)
+
+        if env_prefix is not None:
+            for varName in var_val:
+                rawVal = os.environ.get(env_prefix + varName)
+                if var_val[varName] is None and rawVal is not None:
+                    var_val[varName] = self.createVar(var_typ[varName], rawVal)
+
+        #
+        ## Read unknown values
+        #
+        if verbose is True:
+            for varName in var_val:
+                print(varName, var_val[varName])
+
+        missing = []
+        for varName in var_val:
+            if var_val[varName] is not None:
+                continue
+            if interactive is True:
+                var_val[varName] = self.userRead(varName,
+                                                 var_typ[varName],
+                                                 var_def[varName])
+            elif var_def[varName] is not None:
+                var_val[varName] = var_def[varName]
+            else:
+                missing.append(varName)
+
+        if len(missing) != 0:
+            raise ValueError("Missing config values (no override, environment or default): " + ", ".join(missing))
+
+        #
+        ## DEBUG
+        #
+        if verbose is True:
+            for varName in var_val:
+                print(varName, "=", var_val[varName],"(def=", var_def[varName], ")")
+
+        #
+        ## Create the variables in the class
+        #
+        for varName in var_val:
+            setattr(self, varName, var_val[varName])
 
+    '''
+    Parses a config file into values, defaults and types. The result is cached by
+    path and modification time, so a batch loading the same files parses each only
+    once. Copies are returned, the cached values are never changed.
+    '''
+    def parseFile(self, config_file):
         var_val = collections.OrderedDict()
         var_def = collections.OrderedDict()
         var_typ = collections.OrderedDict()
+        if config_file is None:
+            return var_val, var_def, var_typ
+
+        stat = os.stat(config_file)
+        key = (os.path.abspath(config_file), stat.st_mtime_ns, stat.st_size, type(self))
+        if key in _parsed:
+            return copy.deepcopy(_parsed[key])
+
+        cfgFile = open(config_file, "r")
+        parsedData = list(yaml.safe_load_all(cfgFile))[0]
+        cfgFile.close()
+        if parsedData is None:
+            parsedData = []
 
         #
         ## Parse the list
@@ -85,38 +175,8 @@ class Config():
                 var_def[varName] = None
                 var_typ[varName] = None
 
-
-        #Append the user variables
-        if user_variables is not None:
-            for var in user_variables:
-                var_val[var[0]] = None
-                var_typ[var[0]] = var[1]
-                var_def[var[0]] = var[2]
-
-        #
-        ## Read unknown values
-        #
-        for valName in var_val:
-            print(valName, var_val[valName])
-
-        for varName in var_val:
-            if var_val[varName] is None:
-                print(varName)
-                var_val[varName] = self.userRead(varName,
-                                                 var_typ[varName],
-                                                 var_def[varName])
-
-        #
-        ## DEBUG
-        #
-        for varName in var_val:
-            print(varName, "=", var_val[varName],"(def=", var_def[varName], ")")
-
-        #
-        ## Create the variables in the class
-        #
-        for varName in var_val:
-            setattr(self, varName, var_val[varName])
+        _parsed[key] = (var_val, var_def, var_typ)
+        return copy.deepcopy(_parsed[key])
 
     '''
     This set of functions can be expanded
@@ -217,7 +277,9 @@ class Config():
     '''
 
     def userRead(self, varName, varType, varDef):
-        print(varName, varType, varDef)
+        #Only needed here, loading without the user does not pay for it
+        import readline
+
         rawVal = None
         if varType is None:
             varType = "any"
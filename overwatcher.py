@@ -8,6 +8,48 @@ revisions are kinda subjective, but for example new modifiers should mean a new
 simplified with these) or big changes to the code flow.
 
 Revision history (latest on top):
+    - (REVISION NOT CHANGED) - --results-db: each run (test, device, version, result, options, counters, loop
+    durations and intervals) is added to a SQLite database. "overwatcher.py results" lists the runs and the regressions.
+    - (REVISION NOT CHANGED) - signatures option: every line from the device is checked against catalogs of failure
+    signatures in a separate thread. Hits are logged with context and counted, signatureFail fails the test.
+    - (REVISION NOT CHANGED) - the test ends in a bounded time: sleeps, connects and timers are cancelled and the
+    threads that do not stop in shutdownTimeout seconds are logged and abandoned.
+    - (REVISION NOT CHANGED) - new modifier PIPELINE: the next commands of the action are sent after the echo of the
+    previous one, without waiting for its prompt (up to pipelineDepth commands). The prompts are still counted.
+    - (REVISION NOT CHANGED) - the connects of all tests on the PC go through a shared scheduler (lock files in
+    --connect-dir): limited connects per server and per port, with a random delay. Refused connects are retried.
+    - (REVISION NOT CHANGED) - load mode (--load): after the config, commands from a weighted mix of actions are
+    sent at a target rate, with a window of commands waiting for prompts. Commands/sec and latencies are logged.
+    - (REVISION NOT CHANGED) - memoryTrack option: at the end of each loop the memory use, the queue sizes and the
+    allocation sites that grew the most are logged, with a warning if the memory keeps growing.
+    - (REVISION NOT CHANGED) - logCompress, logRotateSize and logRotateLoops options: the results log can be written
+    compressed (gzip or zstd, in frames that can be read on their own) and split in segments, each with the header.
+    - (REVISION NOT CHANGED) - new optional channels section: extra connections to the device, each one with its own
+    reader, writer, markers and prompts. Test steps are sent to a channel with "<channel>/<step>".
+    - (REVISION NOT CHANGED) - collapseRepeats and noisePatterns options: repeated lines from the device are logged
+    and matched only once, followed by a summary with the number of repeats.
+    - (REVISION NOT CHANGED) - new modifier CAPTURE: the output of the next commands in the action goes to a separate
+    file, only a summary is logged.
+    - (REVISION NOT CHANGED) - new optional intervals section: time between two markers, with statistics logged at
+    each loop and at the end. An interval can fail the test if it takes too long.
+    - (REVISION NOT CHANGED) - infinite tests save a checkpoint (counters, loop, modifiers, random state) at loop
+    boundaries. --resume continues from it without running the config and appends to the existing log.
+    - (REVISION NOT CHANGED) - hotReload option: changes in the test file are applied at the end of each loop of an
+    infinite test. The sha256 of the test file is in the log header and in each reload message.
+    - (REVISION NOT CHANGED) - each test publishes its status (loop, required and last state, timeouts, counts) in a
+    small memory mapped file. "overwatcher.py top" shows all the tests running on the PC.
+    - (REVISION NOT CHANGED) - --profile option: all threads are profiled, the CPU and wall time of each thread is
+    logged at the end and the profile is written next to the log (pstats and a collapsed stack file for flamegraphs).
+    - (REVISION NOT CHANGED) - triggers run in a separate thread for each state, so a long trigger (SLEEP_RANDOM,
+    COUNT, many commands) no longer stops the state watcher. Critical modifiers are still run before the state is
+    published. The trigger latency is logged.
+    - (REVISION NOT CHANGED) - serial tests can use a local serial port or a pty (--tty, --baud) without ser2net.
+    - (REVISION NOT CHANGED) - the reader works on chunks instead of single bytes. On telnet the protocol commands are
+    parsed and removed from the output and the options are negotiated (SUPPRESS-GO-AHEAD, BINARY,
+    TIMING-MARK keepalives). LINEMODE is refused, the device keeps doing the echo and line editing.
+    - (REVISION NOT CHANGED) - all delays and the watchdog go through a clock object. A VirtualClock (--virtual-time)
+    runs tests against simulated devices without sleeping and all random draws use a seeded source (--seed), so runs
+    can be repeated.
     - 20191025 (REVISION NOT CHANGED) - added posibility to run commands on the local PC as part of the test. This is
     done with a new modified LOCAL. All commands after this modifier are ran on the local PC and when the command set is
     finished, it automatically reverts to running commands on the device. Revision is not changed because this does not
@@ -27,6 +69,846 @@ import argparse
 import yaml
 import os
 import subprocess
+import heapq
+import select
+import termios
+import tty
+import sys
+import cProfile
+import pstats
+import mmap
+import glob
+import hashlib
+import json
+import re
+import struct
+import gzip
+import tracemalloc
+import collections
+import fcntl
+import traceback
+import weakref
+import sqlite3
+import uuid
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#Same statistics as the report tool
+try:
+    from .overwatcher_report import percentile
+except ImportError:
+    from overwatcher_report import percentile
+
+#Status record published by each running test (see Overwatcher.status_write and status_top)
+#magic, sequence (odd while writing), pid, loop, timeouts left, started, updated, last transition, test name,
+#required state, last seen state, result, counters
+STATUS_FORMAT = "<4sIiiiddd64s64s64s16s256s"
+STATUS_MAGIC = b"OWS1"
+STATUS_SIZE = struct.calcsize(STATUS_FORMAT)
+STATUS_DIR = "/tmp/overwatcher_status"
+
+CONNECT_DIR = "/tmp/overwatcher_connect"
+SOCK_CONNECT_TIMEOUT = 10 #seconds, for connect and the first answer of the device
+
+#Telnet protocol (RFC 854) bytes handled by the reader
+TELNET_IAC = 255
+TELNET_DONT = 254
+TELNET_DO = 253
+TELNET_WONT = 252
+TELNET_WILL = 251
+TELNET_SB = 250
+TELNET_SE = 240
+
+TELNET_BINARY = 0
+TELNET_ECHO = 1
+TELNET_SGA = 3 #suppress go ahead
+TELNET_TIMING_MARK = 6
+
+SEVERITIES = ["info", "warning", "error", "critical"] #of the failure signatures, lowest first
+SIGNATURE_QUEUE_MAX = 100000 #lines waiting for the signature scanner, more are dropped (and counted)
+
+RESULTS_BATCH_TIME = 2.0 #seconds, rows for the results database are written together
+RESULTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (id TEXT PRIMARY KEY, test TEXT, test_file TEXT, sha256 TEXT, device TEXT,
+    version TEXT, revision TEXT, host TEXT, pid INTEGER, seed INTEGER, started REAL, ended REAL, result TEXT,
+    retval INTEGER, loops INTEGER, timeouts INTEGER, options TEXT, counters TEXT, info TEXT);
+CREATE TABLE IF NOT EXISTS loops (run TEXT, loop INTEGER, ended REAL, duration REAL, timeouts INTEGER);
+CREATE TABLE IF NOT EXISTS intervals (run TEXT, name TEXT, duration REAL);
+CREATE INDEX IF NOT EXISTS runs_test ON runs (test, device, started);
+CREATE INDEX IF NOT EXISTS loops_run ON loops (run);
+CREATE INDEX IF NOT EXISTS intervals_run ON intervals (run);
+"""
+
+CAPTURE_PENDING_MAX = 64 * 1024 #bytes of an unfinished line kept while capturing, more goes to the file
+CAPTURE_TAIL = 256 #bytes at the end of the output checked for a prompt while capturing
+
+INTERVAL_SAMPLES = 2048 #durations kept for the percentiles of each interval
+
+LOG_FRAME_SIZE = 256 * 1024 #text in one compressed frame of the results log
+LOG_FRAME_TIME = 1.0 #seconds, a frame is written after this even if it is not full (never lose much on a crash)
+
+LOAD_TICK = "<load tick>" #put in the state queue by the pacing timer of the load mode
+LOAD_EXPIRE = "<load expire>" #put in the state queue when the oldest command of the load mode might be lost
+ECHO_MAX = 256 #commands remembered for matching their echo after a prompt
+ECHO_ACK = "<echo ack>" #put in the state queue when the echo of a pipelined command is seen
+
+
+def trie_regex(words):
+    """
+    Regular expression matching any of the words, built as a trie so it stays fast with thousands of words
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node):
+        alts = [re.escape(ch) + build(node[ch]) for ch in sorted(node) if ch != ""]
+        if len(alts) == 0:
+            return ""
+        if len(alts) == 1 and "" not in node:
+            return alts[0]
+        ret = "(?:" + "|".join(alts) + ")"
+        if "" in node:
+            ret += "?"
+        return ret
+
+    return build(trie)
+
+
+class SignatureScanner():
+    """
+    Matches lines against a catalog of failure signatures (signatures option) in one pass. The catalog is a YAML
+    dictionary of name : { pattern, severity, regex } or just name : pattern. All the plain text patterns are merged in
+    one regular expression built as a trie, the regex patterns in another one. The signatures are only looked up when
+    a line matches, which is rare. Regex patterns with groups (backreferences) or global flags (ex: "(?i)") cannot be
+    merged, they are checked on their own.
+    """
+    def __init__(self, catalog):
+        self.severity = {}
+        self.literals = {} #text : [ names ]
+        self.regexes = [] #(name, compiled pattern)
+        for name in catalog:
+            elem = catalog[name]
+            if type(elem) is not dict:
+                elem = { "pattern": elem }
+            severity = elem.get("severity", "error")
+            if severity not in SEVERITIES:
+                raise ValueError("Signature " + str(name) + " has unknown severity " + str(severity))
+            self.severity[name] = severity
+            if elem.get("regex", False) is True:
+                try:
+                    self.regexes.append((name, re.compile(elem["pattern"])))
+                except re.error as e:
+                    raise ValueError("Signature " + str(name) + " has an invalid regex: " + str(e))
+            else:
+                self.literals.setdefault(str(elem["pattern"]), []).append(name)
+
+        self.literalMatch = None
+        if len(self.literals) != 0:
+            #In a lookahead, so a signature that starts inside another one is also found
+            self.literalMatch = re.compile("(?=(" + trie_regex(self.literals) + "))")
+        self.regexMatch = None
+        self.regexMerged = [] #(name, compiled pattern) in regexMatch
+        self.regexAlone = [] #the others, checked on each line
+        for name, r in self.regexes:
+            if r.groups == 0 and r.flags == re.compile("").flags:
+                self.regexMerged.append((name, r))
+            else:
+                self.regexAlone.append((name, r))
+        if len(self.regexMerged) != 0:
+            self.regexMatch = re.compile("|".join("(?:" + r.pattern + ")" for name, r in self.regexMerged))
+
+    def __len__(self):
+        return len(self.severity)
+
+    def match(self, line):
+        """
+        Returns the names of the signatures found in the line
+        """
+        hits = []
+        if self.literalMatch is not None:
+            for m in self.literalMatch.finditer(line):
+                text = m.group(1)
+                #The trie matches the longest text, shorter patterns can start at the same place
+                for end in range(1, len(text) + 1):
+                    hits += self.literals.get(text[:end], [])
+        if self.regexMatch is not None and self.regexMatch.search(line) is not None:
+            hits += [name for name, r in self.regexMerged if r.search(line) is not None]
+        hits += [name for name, r in self.regexAlone if r.search(line) is not None]
+        return hits
+
+
+class IntervalStats():
+    """
+    Online statistics for an interval between two markers (see the intervals section of a test). Count, min, mean and
+    max are exact. The percentiles come from a uniform random sample of at most INTERVAL_SAMPLES durations (reservoir
+    sampling), so the memory and the time of a report do not grow with the length of the test.
+    """
+    def __init__(self, name, start, end, limit=None):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.limit = limit #seconds, fail the test if the interval takes longer
+
+        self.started = None #time the start marker was seen
+        self.samples = [] #the reservoir
+        self.count = 0
+        self.last = None
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.rand = random.Random(name) #not the test one, the test draws must not depend on the intervals
+
+    def add(self, duration):
+        self.count += 1
+        if len(self.samples) < INTERVAL_SAMPLES:
+            self.samples.append(duration)
+        else:
+            idx = self.rand.randrange(self.count)
+            if idx < INTERVAL_SAMPLES:
+                self.samples[idx] = duration
+        self.last = duration
+        self.total += duration
+        if self.min is None or duration < self.min:
+            self.min = duration
+        if self.max is None or duration > self.max:
+            self.max = duration
+
+    def summary(self):
+        if self.count == 0:
+            return "no samples"
+        return ("n=" + str(self.count) +
+                " last=" + str(round(self.last, 3)) +
+                " min=" + str(round(self.min, 3)) +
+                " mean=" + str(round(self.total / self.count, 3)) +
+                " p50=" + str(round(percentile(self.samples, 50), 3)) +
+                " p90=" + str(round(percentile(self.samples, 90), 3)) +
+                " p99=" + str(round(percentile(self.samples, 99), 3)) +
+                " max=" + str(round(self.max, 3)))
+
+
+class TestStopped(Exception):
+    """
+    Raised by sock_create and tty_create when the test ends while they wait for the device
+    """
+    pass
+
+
+class RealClock():
+    """
+    Default clock. All delays and the watchdog timers of the test go through a clock object, so they can be replaced.
+    NOTE: cancel() wakes up all the sleeps and cancels all the timers, used when the test ends
+    """
+    def __init__(self):
+        self.stop = threading.Event()
+        self.timers = weakref.WeakSet()
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def now(self):
+        return datetime.datetime.now()
+
+    def sleep(self, duration):
+        self.stop.wait(duration)
+
+    def idle(self):
+        #Real time already passed while waiting, nothing to do
+        pass
+
+    def Timer(self, interval, function):
+        timer = threading.Timer(interval, function)
+        timer.daemon = True
+        self.timers.add(timer)
+        if self.stop.is_set():
+            timer.cancel()
+        return timer
+
+    def cancel(self):
+        self.stop.set()
+        for timer in list(self.timers):
+            timer.cancel()
+
+    def cancelled(self):
+        return self.stop.is_set()
+
+
+class VirtualTimer():
+    """
+    Timer running on a VirtualClock. Same start/cancel interface as threading.Timer.
+    """
+    def __init__(self, clock, interval, function):
+        self.clock = clock
+        self.interval = interval
+        self.function = function
+        self.cancelled = False
+
+    def start(self):
+        self.clock.addTimer(self)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class VirtualClock():
+    """
+    Simulated clock for runs against a simulator or a replayed device. Sleeping only moves the virtual time forward
+    and fires the expired timers. When the device is silent (reader idle), the time jumps to the next timer, so the
+    watchdog still works without waiting for it.
+    """
+    def __init__(self, start=None):
+        if start is None:
+            start = datetime.datetime(2000, 1, 1)
+        self.start = start
+        self.current = 0.0
+        self.timers = [] #heap of (deadline, sequence, timer)
+        self.sequence = 0
+        self.lock = threading.RLock()
+        self.stopped = False
+
+    def time(self):
+        return self.start.timestamp() + self.current
+
+    def monotonic(self):
+        return self.current
+
+    def now(self):
+        return self.start + datetime.timedelta(seconds=self.current)
+
+    def sleep(self, duration):
+        with self.lock:
+            target = self.current + duration
+        self.advance(target)
+
+    def idle(self):
+        with self.lock:
+            #Skip over cancelled timers, jump to the first real one
+            while len(self.timers) != 0 and self.timers[0][2].cancelled is True:
+                heapq.heappop(self.timers)
+            if len(self.timers) == 0:
+                return
+            target = self.timers[0][0]
+        self.advance(target)
+
+    def advance(self, target):
+        """
+        Moves the time up to target, running the timers that expire on the way, in order.
+        """
+        while True:
+            with self.lock:
+                if len(self.timers) == 0 or self.timers[0][0] > target:
+                    self.current = max(self.current, target)
+                    return
+                deadline, seq, timer = heapq.heappop(self.timers)
+                self.current = max(self.current, deadline)
+            #Run outside the lock, the function might start a new timer
+            if timer.cancelled is False:
+                timer.function()
+
+    def addTimer(self, timer):
+        with self.lock:
+            if self.stopped is True:
+                return
+            self.sequence += 1
+            heapq.heappush(self.timers, (self.current + timer.interval, self.sequence, timer))
+
+    def Timer(self, interval, function):
+        return VirtualTimer(self, interval, function)
+
+    def cancel(self):
+        with self.lock:
+            self.stopped = True
+            for elem in self.timers:
+                elem[2].cancelled = True
+            self.timers = []
+
+    def cancelled(self):
+        return self.stopped
+
+
+class TtyPort():
+    """
+    Local serial port (/dev/tty*) or pty, used instead of the socket to ser2net. The port is put in raw mode and it
+    has the same interface the reader and writer use on a socket (recv, sendall, settimeout, close), including
+    socket.timeout when there is nothing to read.
+    """
+    def __init__(self, device, baud=115200):
+        self.device = device
+        self.timeout = None
+        try:
+            speed = getattr(termios, "B" + str(baud))
+        except AttributeError:
+            raise ValueError("Unsupported baud rate " + str(baud))
+
+        self.fd = os.open(device, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            tty.setraw(self.fd)
+            attr = termios.tcgetattr(self.fd)
+            attr[2] |= termios.CLOCAL | termios.CREAD #no modem control lines
+            attr[4] = speed #input speed
+            attr[5] = speed #output speed
+            termios.tcsetattr(self.fd, termios.TCSANOW, attr)
+        except termios.error:
+            os.close(self.fd)
+            raise
+
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def setblocking(self, flag):
+        if flag:
+            self.timeout = None
+        else:
+            self.timeout = 0.0
+
+    def recv(self, size):
+        if self.fd is None:
+            raise OSError("tty closed")
+
+        if self.timeout is None:
+            events = self.poller.poll()
+        else:
+            events = self.poller.poll(int(self.timeout * 1000))
+        if len(events) == 0:
+            raise socket.timeout("tty read timeout")
+
+        try:
+            return os.read(self.fd, size)
+        except BlockingIOError:
+            raise socket.timeout("tty read timeout")
+
+    def sendall(self, data):
+        if self.fd is None:
+            raise OSError("tty closed")
+
+        data = memoryview(data)
+        while len(data) != 0:
+            try:
+                sent = os.write(self.fd, data)
+            except BlockingIOError:
+                select.select([], [self.fd], [], 1)
+                continue
+            data = data[sent:]
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class ThreadProfiler():
+    """
+    Used with --profile. A sampling thread collects the stacks of all threads, including the watchdog timers, for
+    flamegraphs, and reads the CPU time of each thread at every sample. It is cheap enough to leave on for a night.
+    With --profile-calls every overwatcher thread also runs under its own cProfile (merged in one pstats file at the
+    end), which slows down the test.
+    """
+    def __init__(self, interval=0.05, calls=False):
+        self.interval = interval
+        self.calls = calls
+        self.lock = threading.Lock()
+        self.profiles = [] #finished cProfiles
+        self.stacks = {} #(thread name, code objects) : number of samples
+        self.labels = {} #code object : name in the folded file
+        self.threads = {} #thread id : [name, cpu time, first seen, last seen]
+
+        self.running = True
+        self.sampler = threading.Thread(target=self.thread_Sampler, name="profiler", daemon=True)
+        self.sampler.start()
+
+    def cprofile(self):
+        """
+        Returns an enabled cProfile for the calling thread, None if calls are not profiled or if it can not be enabled
+        (since python 3.12 only one can be active at a time)
+        """
+        if self.calls is False:
+            return None
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            return None
+        return prof
+
+    def wrap(self, target):
+        """
+        Returns target running under cProfile, or target itself if calls are not profiled
+        """
+        if self.calls is False:
+            return target
+
+        def profiled(*args):
+            prof = self.cprofile()
+            try:
+                target(*args)
+            finally:
+                if prof is not None:
+                    prof.disable()
+                    self.addProfile(prof)
+        return profiled
+
+    def addProfile(self, prof):
+        with self.lock:
+            self.profiles.append(prof)
+
+    def thread_Sampler(self):
+        me = threading.get_ident()
+        while self.running is True:
+            time.sleep(self.interval) #always real time, even on a virtual clock
+
+            names = {}
+            for th in threading.enumerate():
+                if isinstance(th, threading.Timer):
+                    names[th.ident] = "timer"
+                else:
+                    names[th.ident] = th.name
+
+            now = time.monotonic()
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                name = names.get(ident, "unknown")
+
+                #Only the code objects here, the text is built once per function when writing
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                key = (name, tuple(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+                try:
+                    cpu = time.clock_gettime(time.pthread_getcpuclockid(ident))
+                except (OSError, AttributeError):
+                    cpu = 0.0
+                try:
+                    self.threads[ident][1] = cpu
+                    self.threads[ident][3] = now
+                except KeyError:
+                    self.threads[ident] = [name, cpu, now, now]
+
+    def stop(self):
+        self.running = False
+        self.sampler.join()
+
+    def threadTimes(self):
+        """
+        Returns {thread name : (cpu time, wall time)}, threads with the same name (timers) are added together
+        """
+        ret = {}
+        for name, cpu, first, last in self.threads.values():
+            old = ret.get(name, (0.0, 0.0))
+            ret[name] = (old[0] + cpu, old[1] + last - first)
+        return ret
+
+    def write(self, basename):
+        """
+        Writes basename_profile.pstats and basename_profile.folded (one "stack count" per line, for flamegraph.pl)
+        """
+        with self.lock:
+            if len(self.profiles) != 0:
+                stats = pstats.Stats(self.profiles[0])
+                for prof in self.profiles[1:]:
+                    stats.add(prof)
+                stats.dump_stats(basename + "_profile.pstats")
+
+        with open(basename + "_profile.folded", "w") as f:
+            for key in self.stacks:
+                name, codes = key
+                stack = [name] + [self.label(code) for code in reversed(codes)]
+                f.write(";".join(stack) + " " + str(self.stacks[key]) + "\n")
+
+    def label(self, code):
+        try:
+            return self.labels[code]
+        except KeyError:
+            text = code.co_name + " (" + os.path.basename(code.co_filename) + ":" + str(code.co_firstlineno) + ")"
+            self.labels[code] = text
+            return text
+
+
+class ConnectScheduler():
+    """
+    Spreads the connects to the terminal servers of all the overwatcher processes of the PC. Each connect takes a slot
+    of its host and a slot of its host and port. The slots are files locked with flock in a shared directory, so a
+    slot is freed even if its process dies. A connect that finds no free slot waits for one.
+    NOTE: the directory is shared by all the users of the PC (sticky and writable by all, like /tmp)
+    """
+    def __init__(self, directory=CONNECT_DIR, perHost=4, perPort=1, jitter=2.0):
+        self.directory = directory
+        self.perHost = perHost #0 for no limit
+        self.perPort = perPort #0 for no limit
+        self.jitter = jitter #seconds, random delay before each connect
+        #Not the test one (the connects happen in any thread) and not from --seed, tests started together with the
+        #same seed must still get different delays
+        self.rand = random.Random(hash((os.getpid(), time.time_ns())))
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if os.stat(self.directory).st_uid == os.getuid():
+                os.chmod(self.directory, 0o1777) #makedirs is limited by the umask
+        except OSError:
+            pass #acquire fails and the test connects without a slot
+
+    def slot(self, name, count):
+        """
+        Locks one of the slots of name, returns the locked file descriptor or None if all are taken
+        NOTE: flock needs no write access, the lock files of other users can be opened read only
+        """
+        for idx in range(count):
+            fd = os.open(os.path.join(self.directory, name + "." + str(idx) + ".lock"), os.O_RDONLY | os.O_CREAT,
+                         0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    def acquire(self, host, port, clock):
+        """
+        Waits for a free slot for host and port. Returns the slots, the jitter and the time waited for the slots.
+        Raises OSError if the slots cannot be opened, nothing stays locked.
+        NOTE: the wait is in real time, the other processes do not use our clock
+        """
+        jitter = self.rand.uniform(0, self.jitter)
+        clock.sleep(jitter)
+
+        host = re.sub(r"[^\w.-]", "_", str(host))
+        start = time.monotonic()
+        while True:
+            slots = []
+            try:
+                if self.perHost != 0:
+                    slots.append(self.slot(host, self.perHost))
+                if self.perPort != 0 and None not in slots:
+                    slots.append(self.slot(host + "_" + str(port), self.perPort))
+            except OSError:
+                self.release(slots)
+                raise
+            if None not in slots:
+                return slots, jitter, time.monotonic() - start
+            self.release(slots)
+            if clock.cancelled():
+                return [], jitter, time.monotonic() - start
+            time.sleep(0.1 + self.rand.uniform(0, 0.1))
+
+    def release(self, slots):
+        for fd in slots:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+
+class ResultsStore():
+    """
+    Optional SQLite database with the results of all runs (--results-db). The test only queues the rows, a thread
+    writes them in batches, so the test never waits for the database (which can be shared by many tests).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.thread_Writer, name="results db", daemon=True)
+        self.thread.start()
+
+    def execute(self, sql, params=()):
+        self.queue.put((sql, params))
+
+    def thread_Writer(self):
+        try:
+            db = sqlite3.connect(self.path, timeout=60)
+            db.executescript(RESULTS_SCHEMA)
+        except sqlite3.Error as err:
+            print("RESULTS DB", self.path, "failed:", err)
+            return
+
+        running = True
+        while running is True:
+            batch = [self.queue.get(block=True)]
+            deadline = time.monotonic() + RESULTS_BATCH_TIME
+            while batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get(block=True, timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                running = False
+                batch.pop()
+
+            try:
+                with db:
+                    for sql, params in batch:
+                        db.execute(sql, params)
+            except sqlite3.Error as err:
+                print("RESULTS DB write failed:", err)
+        db.close()
+
+    def close(self, timeout):
+        """
+        Writes what is left. Returns False if it did not finish in time.
+        """
+        self.queue.put(None)
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+
+class ResultsLog():
+    """
+    Results log, plain or compressed (gzip or zstd), optionally split in segments.
+
+    The compressed log is written in frames (a gzip member or a zstd frame) of about LOG_FRAME_SIZE bytes, or what was
+    logged in LOG_FRAME_TIME seconds if that is less (a thread writes the frames of a quiet log). Each frame can
+    be decompressed on its own and the file can be read while the test runs (zcat, overwatcher_report.py). The
+    segments are named <base>_0000.log[.gz|.zst], <base>_0001.log[.gz|.zst]... Rotating is done by the caller, which
+    also writes the header again.
+    """
+    def __init__(self, base, compress="none", segments=False, append=False):
+        if compress not in ("none", "gzip", "zstd"):
+            raise ValueError("Unknown log compression " + str(compress))
+        if compress == "zstd" and zstandard is None:
+            raise ValueError("zstd log compression needs the zstandard module")
+
+        self.base = base
+        self.compress = compress
+        self.segments = segments
+        self.ext = { "none": "", "gzip": ".gz", "zstd": ".zst" }[compress]
+        self.lock = threading.RLock()
+
+        self.segment = 0
+        if segments is True and append is True:
+            #Continue after the last segment of the run
+            while os.path.exists(self.path(self.segment + 1)):
+                self.segment += 1
+        self.open(append)
+
+        self.stop = threading.Event()
+        if compress != "none":
+            self.flusher = threading.Thread(target=self.thread_Flusher, name="log flush", daemon=True)
+            self.flusher.start()
+
+    def thread_Flusher(self):
+        while not self.stop.wait(LOG_FRAME_TIME / 2):
+            with self.lock:
+                if self.frameLen != 0 and time.monotonic() - self.frameStart >= LOG_FRAME_TIME:
+                    self.flush()
+
+    def path(self, segment=None):
+        if self.segments is False:
+            return self.base + ".log" + self.ext
+        if segment is None:
+            segment = self.segment
+        return self.base + "_%04d.log" % segment + self.ext
+
+    def open(self, append):
+        mode = "a" if append is True else "w"
+        if self.compress == "none":
+            self.f = open(self.path(), mode, buffering=1)
+        else:
+            self.f = open(self.path(), mode + "b")
+        self.frame = []
+        self.frameLen = 0
+        self.frameStart = time.monotonic() #when the first text of the frame was written
+        self.size = 0 #bytes written in this segment, before compression
+
+    def write(self, text):
+        with self.lock:
+            if self.f is None:
+                raise ValueError("I/O operation on closed results log")
+            self.size += len(text)
+            if self.compress == "none":
+                return self.f.write(text)
+
+            if self.frameLen == 0:
+                self.frameStart = time.monotonic()
+            self.frame.append(text)
+            self.frameLen += len(text)
+            if self.frameLen >= LOG_FRAME_SIZE or time.monotonic() - self.frameStart >= LOG_FRAME_TIME:
+                self.flush()
+            return len(text)
+
+    def flush(self):
+        """
+        Writes the buffered text as a complete frame
+        """
+        with self.lock:
+            if self.f is None or self.compress == "none":
+                return
+            if self.frameLen == 0:
+                return
+            data = "".join(self.frame).encode(errors="replace")
+            if self.compress == "gzip":
+                self.f.write(gzip.compress(data, compresslevel=6))
+            else:
+                self.f.write(zstandard.ZstdCompressor().compress(data))
+            self.f.flush()
+            self.frame = []
+            self.frameLen = 0
+
+    def rotate(self):
+        with self.lock:
+            self.flush()
+            self.f.close()
+            self.segment += 1
+            self.open(False)
+
+    def close(self):
+        self.stop.set()
+        with self.lock:
+            if self.f is None:
+                return
+            self.flush()
+            self.f.close()
+            self.f = None
+
+
+class Channel():
+    """
+    Extra connection to the device (channels section of a test), ex: a management shell over telnet next to the
+    serial console. It has the same connection attributes as Overwatcher, which is the main channel, so the reader,
+    writer and state watcher threads work the same way on all channels.
+    """
+    def __init__(self, name, cfg, parent):
+        self.channel = name
+        self.server = cfg.get("server", "localhost")
+        self.port = cfg.get("port", 23)
+        self.telnetTest = cfg.get("telnet", False)
+        self.ttyDevice = cfg.get("tty")
+        self.baud = cfg.get("baud", 115200)
+
+        if cfg.get("endr", False) is False:
+            self.sendendr = 'noendr'
+        else:
+            self.sendendr = 'endr'
+        if self.telnetTest is False:
+            self.eol= { 'endr': "\r\n", 'noendr': "\n"}
+        else:
+            self.eol= { 'endr': "\r", 'noendr': "\r" }
+
+        self.markers = dict(cfg.get("markers") or {})
+        self.statewatcher_markers = dict(self.markers)
+        self.prompts = list(cfg.get("prompts") or [])
+
+        self.mainSocket = None
+        self.queue_serread = queue.Queue()
+        self.queue_serwrite = queue.Queue()
+        self.echo = collections.deque(maxlen=ECHO_MAX) #commands sent, see echoPrompts
+        self.echoWait = collections.deque() #pipelined commands waiting for their echo
+        self.echoLock = threading.Lock() #echoWait is changed by the state watcher and by the test thread
+
+        self.telnet_remoteOptions = parent.telnet_remoteOptions
+        self.telnet_localOptions = parent.telnet_localOptions
+        self.repeat = {"key": None, "count": 0, "first": None, "last": None, "relevant": False}
 
 
 class Overwatcher():
@@ -49,8 +931,7 @@ class Overwatcher():
         self.name = os.path.splitext(os.path.basename(test))[0] #Used for log file, get only the name
         self.full_name = os.path.abspath(test) #Also save the full file path in the logs, because you never know
 
-        tf = open(test, "r")
-        elems = list(yaml.safe_load_all(tf))[0]
+        elems = self.load_test(test)
 
         #Thanks to YAML this was easy
         self.info = dict(elems['info'])
@@ -62,9 +943,85 @@ class Overwatcher():
         self.config_seq = list(elems['initconfig'])
         self.test_seq = list(elems['test'])
 
+        #Optional
+        self.intervals = dict(elems.get('intervals') or {})
+        self.channels_cfg = dict(elems.get('channels') or {})
+        self.load = dict(elems.get('load') or {})
+
         #What we need to worry about are the options
+        self.test_options = dict(elems['options'])
         for opt in elems['options']:
             setattr(self, opt, elems['options'][opt])
+
+    def load_test(self, test):
+        """
+        Reads the YAML test file. Also keeps its hash and modification time, to know when it changes.
+        """
+        with open(test, "rb") as tf:
+            content = tf.read()
+
+        self.test_file = test
+        self.test_hash = hashlib.sha256(content).hexdigest()
+        self.test_mtime = os.stat(test).st_mtime
+
+        return list(yaml.safe_load_all(content))[0]
+
+    def reload_test(self):
+        """
+        Hot reload (hotReload option), called by the test thread at the end of a loop. If the test file changed, the
+        markers, prompts, triggers, actions and test sequence are replaced. Options and the initial configuration
+        are not touched.
+
+        Returns True if the test was reloaded.
+        """
+        if self.test_file is None:
+            return False
+
+        old_hash = self.test_hash
+        try:
+            if os.stat(self.test_file).st_mtime == self.test_mtime:
+                return False
+            elems = self.load_test(self.test_file)
+            if self.test_hash == old_hash:
+                return False
+
+            markers = dict(elems['markers'])
+            prompts = list(elems['prompts'])
+            triggers = dict(elems['triggers'])
+            actions = dict(elems['actions'])
+            test_seq = list(elems['test'])
+            intervals = dict(elems.get('intervals') or {})
+        except (OSError, yaml.YAMLError, KeyError, TypeError, ValueError) as e:
+            self.log("RELOAD FAILED, keeping the old test:", repr(e))
+            self.test_hash = old_hash
+            return False
+
+        #New states with triggers need their threads
+        for state in triggers:
+            if state not in self.queue_triggers:
+                self.queue_triggers[state] = queue.Queue()
+                self.thread_start("trigger " + state, self.thread_Trigger, state)
+
+        #Swap everything at once, the state watchers use the new test from the next line
+        with self.reload_lock:
+            self.prompts = prompts
+            self.triggers = triggers
+            self.actions = actions
+            self.test_seq = test_seq
+            self.markers = markers
+            self.statewatcher_markers = dict(markers)
+            self.intervals = intervals
+            self.intervals_setup()
+        self.adaptive_reset()
+
+        self.log("RELOADED TEST", self.test_file, "sha256", self.test_hash, "(was", old_hash, ")")
+        self.log("MARKERS:", self.markers)
+        self.log("PROMPTS:", self.prompts)
+        self.log("TRIGGERS:", self.triggers)
+        self.log("ACTIONS:", self.actions)
+        self.log("TEST SEQ:", self.test_seq)
+        self.log("INTERVALS:", self.intervals)
+        return True
     """
     -------------------------TEST RESULT FUNCTIONS, called on test ending. Can be overloaded.
     """
@@ -73,12 +1030,32 @@ class Overwatcher():
         Trying to improve the timeout problem. Sometimes the socket fluctuates and
         overwatcher misses some output. This should be solved with a CR.
         """
+        #Do not keep hiding the output from the state watcher
+        self.capture_stop("timeout")
+
+        self.file_test.flush()
+        armed = self.adaptive_armed
+        if armed is not None:
+            self.log("WATCHDOG step", armed, "took longer than learned")
+        self.adaptive_timedOut = True #the watchdog is restarted, do not learn from this step
+        self.counter_timeouts += 1
+
+        if len(self.pipeline) != 0:
+            self.log("PIPELINE command", repr(self.pipeline[0][0]), "did not get its prompt,", len(self.pipeline),
+                     "commands waiting")
+
         if self.counter["test_timeouts"] == 0:
             self.setResult("timeout")
         else:
             self.counter["test_timeouts"] -= 1
             self.log("GOT A TIMEOUT, giving it another try...we have", self.counter["test_timeouts"], "left")
-            self.mainTimer = self.timer_startTimer(self.mainTimer)
+            self.status_write()
+            if armed is not None and armed in self.adaptive_profile:
+                #Try again at the learned pace, a hung device is reported in seconds not after the full timeouts
+                self.adaptive_start = self.clock.monotonic()
+                self.mainTimer = self.timer_startTimer(self.mainTimer, self.adaptive_profile[armed])
+            else:
+                self.mainTimer = self.timer_startTimer(self.mainTimer)
             if self.telnetTest is False:
                 #On telnet this does not help
                 self.sendDeviceCmd("") #Send a CR
@@ -113,8 +1090,49 @@ class Overwatcher():
 
         self.largeCommand = 50 #what command should be sent into parts
 
+        self.readChunk = 4096 #how much to read from the device at once
+
+        self.collapseRepeats = False #log and match repeated lines only once
+        self.noisePatterns = [] #regular expressions, consecutive lines matching the same one count as repeats
+
+        #Telnet options accepted from the device and done by us, the rest are refused
+        #NOTE: no LINEMODE, in EDIT mode some devices stop echoing and the echo is needed (PIPELINE, load mode)
+        self.telnet_remoteOptions = [TELNET_ECHO, TELNET_SGA, TELNET_BINARY]
+        self.telnet_localOptions = [TELNET_SGA, TELNET_BINARY]
+
         self.strictStates = True #by default, enforce
 
+        self.hotReload = False #apply changes of the test file at the end of each loop
+
+        self.checkpointLoops = 1 #on infinite tests, save a checkpoint every N loops (0 to disable)
+
+        self.memoryTrack = False #log memory use and the top allocation sites at the end of each loop
+        self.memoryTop = 10 #how many allocation sites to log
+        self.memoryGrowthLoops = 5 #warn when the memory grows for this many loops in a row
+
+        self.adaptiveTimeout = False #learn how long each step takes and arm the watchdog for it
+        self.adaptiveLoops = 5 #loops used for learning
+        self.adaptivePercentile = 99
+        self.adaptiveFactor = 3.0 #watchdog = factor * percentile of the learned durations
+        self.adaptiveMin = 5.0 #seconds, the watchdog is never shorter
+
+        self.shutdownTimeout = 10 #seconds to wait for the threads when the test ends, the rest are abandoned
+
+        self.signatures = [] #catalogs of failure signatures checked on every line, see SignatureScanner
+        self.signatureFail = None #fail the test on a signature with this severity or higher
+        self.signatureContext = 3 #lines logged before a signature
+
+        self.pipelineDepth = 4 #commands sent before their prompt is seen, with the PIPELINE modifier
+        self.pipelineUnsafe = [] #actions that are always sent one command at a time
+
+        self.logCompress = "none" #none, gzip or zstd
+        self.logRotateSize = 0 #start a new log segment after this many MB of text (0 to disable)
+        self.logRotateLoops = 0 #on infinite tests, start a new log segment every N loops (0 to disable)
+
+        #Set by load_test, only YAML tests can be reloaded
+        self.test_file = None
+        self.test_hash = None
+
         self.config_seq = []
         self.test_seq = []
 
@@ -128,8 +1146,19 @@ class Overwatcher():
 
         self.prompts = []
 
+        #Extra connections: name : { server, port, telnet, endr, tty, baud, markers, prompts }
+        self.channels_cfg = {}
+
+        #Load mode (--load): mix: { action : weight }, rate, window, duration, count
+        self.load = {}
+
+        #Timed intervals between markers: name : { start: marker, end: marker, max: seconds }
+        self.intervals = {}
+        self.interval_stats = {}
+
         #Various test information
         self.info = {}
+        self.test_options = {} #as given in the test, for the results database
 
     def setup_modifiers_defaults(self):
         self.opt_RunTriggers = True
@@ -138,6 +1167,13 @@ class Overwatcher():
         self.opt_TimeCmd = False
         self.mod_PromptWait = True
         self.mod_RunLocal = False
+        self.mod_Capture = False
+        self.capture = None #file and stats while capturing
+        self.capture_count = 0
+        self.capture_lock = threading.Lock()
+        self.reload_lock = threading.Lock() #held by the state watchers for each line and by a reload for the swap
+        self.mod_Pipeline = False
+        self.pipeline = [] #[command, echo seen] sent and waiting for a prompt
 
         self.modifiers ={  # Quick modifier set
                 "IGNORE_STATES" : self.e_IgnoreStates,
@@ -151,12 +1187,21 @@ class Overwatcher():
                 "TIMECMD"       : self.timeCommand,
                 "NOTSTRICT"     : self.notStrict,
                 "NOPRWAIT"      : self.d_PromptWait,
-                "LOCAL"         : self.e_runLocal
+                "LOCAL"         : self.e_runLocal,
+                "CAPTURE"       : self.e_Capture,
+                "PIPELINE"      : self.e_Pipeline
                 }
 
+        #Actions with these are never pipelined
+        self.pipeline_unsafeModifiers = ["IGNORE_STATES", "LOCAL", "CAPTURE", "NOPRWAIT"]
+
         #What we need to run even if states are ignored and triggers disabled
         self.critical_modifiers = ["WATCH_STATES", "TRIGGER_START"]
 
+        #Modifiers of a trigger that take time, they run in the trigger thread with the commands. The rest only change
+        #flags and are applied by the state watcher, before the state is published
+        self.trigger_threadModifiers = ["SLEEP_RANDOM", "COUNT"]
+
         self.retval = {   
                             "config failed":    3,
                             "timeout" :         2,
@@ -164,14 +1209,66 @@ class Overwatcher():
                             "ok":               0
                       }
 
-    def __init__(self, test, server='169.168.56.254', port=23200, runAsTelnetTest=False, endr=False):
+    def __init__(self, test, server='169.168.56.254', port=23200, runAsTelnetTest=False, endr=False, clock=None,
+                 seed=None, tty=None, baud=115200, profile=False, status_dir=None, resume=False, load=False,
+                 connect=None, results_db=None, profile_calls=False):
         """
         Class init. KISS 
         NOTE: keeping default for backwards compatibility...for now
+        NOTE: clock can be a VirtualClock to run against simulated devices without sleeping. The seed makes all random
+        draws reproducible (a random one is chosen and logged if not given).
+        NOTE: if tty is given (/dev/ttyUSB0, a pty...), the serial port is used directly, server and port are ignored.
+        NOTE: profile turns on the profiling of all threads, results are written next to the log at the end.
+        profile_calls also runs cProfile in every thread (a lot slower).
+        NOTE: if status_dir is given, the test publishes its status there for "overwatcher top".
+        NOTE: resume continues an infinite test from its last checkpoint, without running the config again.
+        NOTE: load runs the load section of the test instead of the test sequence.
+        NOTE: connect is a ConnectScheduler shared with the other tests of the PC, None to connect right away.
+        NOTE: results_db is the SQLite file where the results of the run are saved (see ResultsStore), if given.
         """
+        #All delays and timers go through this
+        if clock is None:
+            clock = RealClock()
+        self.clock = clock
+
+        #Live status, see status_write
+        self.status_dir = status_dir
+        self.status_map = None
+        self.status = {
+                        "started": time.time(),
+                        "transition": time.time(),
+                        "required": "",
+                        "last": "",
+                        "result": ""
+                      }
+        #Only the first result counts, the ones set while stopping the threads do not change it
+        self.result_final = None
+        self.result_lock = threading.Lock()
+
+        #Results database, the run is added after the log file is opened
+        self.results = None
+        if results_db is not None:
+            self.results = ResultsStore(results_db)
+
+        #Started after the log file is opened
+        self.profile = profile or profile_calls
+        self.profileCalls = profile_calls
+        self.profiler = None
+
+        #All random draws use this, so a run can be repeated
+        if seed is None:
+            seed = random.randrange(2**32)
+        self.seed = seed
+        self.rand = random.Random(seed)
+
         #Connection stuff
+        self.connect = connect
         self.server = server
         self.port = port
+        self.ttyDevice = tty
+        self.baud = baud
+        self.channel = None #this is the main channel, see Channel
+        self.channels = {}
         if endr is False:
             self.sendendr = 'noendr'
         else:
@@ -199,15 +1296,23 @@ class Overwatcher():
 
         #Store counts for various triggers
         self.counter = {}
+        self.counter_lock = threading.Lock() #COUNT runs in the trigger threads, readers take a snapshot
         self.counter["test_loop"] = 1
         self.counter["test_timeouts"] = self.test_max_timeouts
+        self.counter_timeouts = 0 #all the timeouts of the run, for the results database
 
         self.queue_state = queue.Queue() 
+        self.state_putback = collections.deque() #states skipped by a prompt wait, read again before the queue
         self.queue_result = queue.Queue()
 
         self.queue_serread = queue.Queue()
         self.queue_serwrite = queue.Queue()
+        self.echo = collections.deque(maxlen=ECHO_MAX)
+        self.echoWait = collections.deque()
+        self.echoLock = threading.Lock()
 
+        #When commands are sent before the prompt is seen, the prompt is followed by the echo of the next command
+        self.echoPrompts = False
 
         #Start with defaults
         self.setup_test_defaults()
@@ -218,14 +1323,44 @@ class Overwatcher():
 
         #Load the user setup
         self.setup_test(test)
+        self.intervals_setup()
+        self.repeat_setup()
+        self.memory_setup()
+        self.adaptive_setup()
+        self.signatures_setup()
+        self.loadMode = load
+        if self.loadMode is True:
+            self.load_setup()
+            self.echoPrompts = True
+
+        #When resuming, load the checkpoint before the seed is written in the log
+        self.resume = resume
+        self.test_startIdx = 0
+        if self.resume is True:
+            checkpoint = self.checkpoint_read()
 
         #Open the log file and print everything
-        self.file_test = open(self.name + "_testresults.log", "w", buffering=1)
+        segments = self.logRotateSize != 0 or self.logRotateLoops != 0
+        self.file_test = ResultsLog(self.name + "_testresults", self.logCompress, segments, append=self.resume)
+        if self.resume is True:
+            self.file_test.write("\n\n\nRESUMED FROM CHECKPOINT " + self.checkpoint_file() + "\n\n")
         self.print_test()
 
+        self.status_open()
+        self.results_start()
+
         self.sleep_sockWait = 0 #Just for startup
         self.mainSocket = self.sock_create()
-        self.sleep_sockWait = 30 #seconds
+
+        #Opening the socket resets the modifiers, restore them after
+        if self.resume is True:
+            self.checkpoint_restore(checkpoint)
+
+        for name in self.channels_cfg:
+            channel = Channel(name, self.channels_cfg[name], self)
+            channel.mainSocket = self.sock_create(channel)
+            self.channels[name] = channel
+        self.sleep_sockWait = 30 #seconds, only for the reconnects
 
         #For the config phase also use the cfg only markers
         self.statewatcher_markers = dict(self.markers_cfg)
@@ -235,23 +1370,37 @@ class Overwatcher():
         self.run = {}
         self.th = {}
 
-        self.run["recv"] = True #receiver loop - used to get out of large commands
-        self.th["recv"] = threading.Thread(target=self.thread_SerialRead, daemon=True)
-        self.th["recv"].start()
+        if self.profile is True:
+            self.profiler = ThreadProfiler(calls=self.profileCalls)
+            #The config runs in this thread
+            self.mainProfile = self.profiler.cprofile()
+
+        if self.scanner is not None:
+            self.thread_start("signatures", self.thread_Signatures)
+        self.thread_start("recv", self.thread_SerialRead) #receiver loop - used to get out of large commands
+        self.thread_start("send", self.thread_SerialWrite)
+
+        #One thread per state with triggers, started before the state watcher
+        self.queue_triggers = {}
+        self.trigger_maxLatency = 0.0
+        for state in self.triggers:
+            self.queue_triggers[state] = queue.Queue()
+            self.thread_start("trigger " + state, self.thread_Trigger, state)
 
-        self.run["send"] = True #receiver loop - used to get out of large commands
-        self.th["send"] = threading.Thread(target=self.thread_SerialWrite, daemon=True)
-        self.th["send"].start()
+        self.thread_start("state_watcher", self.thread_StateWatcher)
 
-        self.run["state_watcher"] = True
-        self.th["state_watcher"] = threading.Thread(target=self.thread_StateWatcher, daemon=True)
-        self.th["state_watcher"].start()
+        for name in self.channels:
+            self.thread_start("recv " + name, self.thread_SerialRead, self.channels[name])
+            self.thread_start("send " + name, self.thread_SerialWrite, self.channels[name])
+            self.thread_start("state_watcher " + name, self.thread_StateWatcher, self.channels[name])
 
-        #Configure the device
-        self.config_device()
+        #Configure the device (already done if resuming)
+        if self.resume is False:
+            self.config_device()
 
         #For the normal run, revert back to the normal markers
         self.statewatcher_markers = dict(self.markers)
+        self.results_loopStart = self.clock.monotonic() #the first loop starts after the config, as in the log
 
         #See if the config failed
         res = self.getResult(block=False)
@@ -260,9 +1409,10 @@ class Overwatcher():
             exit(res)
 
         #Start the TEST thread
-        self.run["test"] = True
-        self.th["test"] = threading.Thread(target=self.thread_MyTest, daemon=True)
-        self.th["test"].start()
+        if self.loadMode is True:
+            self.thread_start("test", self.thread_Load)
+        else:
+            self.thread_start("test", self.thread_MyTest)
 
         res = self.getResult(block=True)
         self.cleanAll()
@@ -281,7 +1431,7 @@ class Overwatcher():
         conf_idx = 0
         while(conf_idx < conf_len):
             #Look for the state
-            req_state = self.config_seq[conf_idx]
+            channel, req_state = self.step_channel(self.config_seq[conf_idx])
 
             #
             ##  See if we need to run some actions
@@ -289,20 +1439,22 @@ class Overwatcher():
             try:
                 self.log("RUNNING ACTIONS:", req_state, "=", self.actions[req_state])
                 for elem in self.actions[req_state]:
-                    self.sendDeviceCmd(elem)
-                    self.waitDevicePrompt(elem)
+                    self.sendDeviceCmd(elem, channel)
+                    self.waitDevicePrompt(elem, channel)
                 conf_idx += 1
                 continue
             except KeyError:
                 pass
 
             self.log("Looking for:", self.config_seq[conf_idx]) #idx might change
-            current_state = self.getDeviceState()
+            self.status["required"] = req_state
+            self.status_write()
+            current_state, seenOn = self.getDeviceStateChannel()
             if current_state == "":
                 break
 
             # If the required state is found 
-            if req_state == current_state:
+            if self.step_seen(channel, req_state, current_state, seenOn) is True:
                 self.log("MOVED TO STATE=", req_state)
                 conf_idx += 1
 
@@ -316,161 +1468,400 @@ class Overwatcher():
     """
     -------------------------THREADS
     """
-    def thread_SerialRead(self):
+    def thread_start(self, name, target, *args):
+        """
+        Starts one of the overwatcher threads. It can be stopped with self.run[name] and joined with self.th[name].
+        """
+        if self.profiler is not None:
+            target = self.profiler.wrap(target)
+        self.run[name] = True
+        self.th[name] = threading.Thread(target=target, args=args, name=name, daemon=True)
+        self.th[name].start()
+
+    def thread_SerialRead(self, conn=None):
         """
         Receiver thread. 
         Job: parses serial out and forms things in sentences. Does not interpret the information, except the line
         endings to form lines.
+        NOTE: reads in chunks, not byte by byte. On telnet, the protocol commands are removed here.
+        NOTE: conn is the channel to read, the main one if not given.
         """
-        while self.run["recv"] is True:
-            serout = ""
-            while self.run["recv"] is True:
-                #Why do the timeout: the login screen displays "User:" and no endline.
-                #How do you know that the device is waiting for something in this case?
+        if conn is None:
+            conn = self
+        run = self.thread_name("recv", conn)
+
+        eol = conn.eol[conn.sendendr][0]
+        serout = ""
+        while self.run[run] is True:
+            #Why do the timeout: the login screen displays "User:" and no endline.
+            #How do you know that the device is waiting for something in this case?
+            try:
+                x = conn.mainSocket.recv(self.readChunk)
+            except socket.timeout:
+                if serout == "":
+                    #Device is silent, nothing happens until a timer expires
+                    if conn is self:
+                        self.clock.idle()
+                    if self.collapseRepeats is True:
+                        self.repeat_flush(conn)
+                self.handleDeviceLine(serout, conn)
+                serout = ""
+                continue
+            except OSError:
+                self.log("Reopening socket", self.thread_name("", conn))
+                self.handleDeviceLine(serout, conn)
+                serout = ""
                 try:
-                    x = self.mainSocket.recv(1)
-                except socket.timeout:
-                    x = self.eol[self.sendendr].encode() #same line ending
+                    conn.mainSocket = self.sock_create(conn)
+                except TestStopped:
                     break
-                except OSError:
-                    self.log("Reopening socket")
-                    self.mainSocket = self.sock_create()
-                    break #restart reading
-
-                if not x:
-                    self.log("Socket closed, reopening")
-                    self.mainSocket = self.sock_create()
-                    break #restart reading
+                continue #restart reading
 
+            if not x:
+                self.log("Socket closed, reopening", self.thread_name("", conn))
+                self.handleDeviceLine(serout, conn)
+                serout = ""
                 try:
-                    serout += x.decode('ascii')
-                except UnicodeDecodeError:
-                    pass
-
-                #Doing this to make sure we match correctly everytime
-                #and to take into account the \r\n situation
-                if x == self.eol[self.sendendr][0].encode():
+                    conn.mainSocket = self.sock_create(conn)
+                except TestStopped:
                     break
+                continue #restart reading
+
+            if conn.telnetTest is True:
+                x = self.telnet_filter(conn.mainSocket, x, conn)
+
+            if self.capture is not None and conn is self:
+                #Goes straight to the capture file, only what is left after the prompt is processed
+                x = self.capture_data(x)
+
+            serout += x.decode('ascii', errors='ignore')
+
+            #Doing this to make sure we match correctly everytime
+            #and to take into account the \r\n situation
+            lines = serout.split(eol)
+            serout = lines.pop() #not finished yet
+            for line in lines:
+                self.handleDeviceLine(line + eol, conn)
+
+            #Prompts have no endline, do not wait for the read timeout when timing the commands
+            if self.echoPrompts is True and serout != "" and self.promptTail(serout, conn) is True:
+                self.handleDeviceLine(serout, conn)
+                serout = ""
+
+        self.sock_close(conn.mainSocket)
+
+    def promptTail(self, serout, conn):
+        """
+        True if the (unfinished) line ends with a prompt of the channel
+        """
+        tail = serout.rstrip()
+        markers = conn.statewatcher_markers
+        for marker in markers:
+            if markers[marker] in conn.prompts and tail.endswith(marker):
+                return True
+        return False
+
+    def thread_name(self, name, conn):
+        """
+        Threads (and log tags) of the extra channels have the channel name added
+        """
+        if conn is None or conn.channel is None:
+            return name
+        return (name + " " + conn.channel).strip()
+
+    def log_tag(self, tag, conn):
+        if conn is None or conn.channel is None:
+            return tag
+        return tag + "@" + conn.channel
+
+    def step_channel(self, step):
+        """
+        Test and config steps can be sent to a channel with "<channel>/<step>". Returns (channel, step), the channel
+        is self for the main one.
+        """
+        if type(step) is str and "/" in step:
+            name, rest = step.split("/", 1)
+            if name in self.channels:
+                return self.channels[name], rest
+        return self, step
+
+    def step_seen(self, channel, required, state, seenOn):
+        """
+        True if the state is the one the step waits for. A state step without a channel is satisfied by any channel,
+        a "<channel>/<state>" step only by its channel.
+        """
+        if state != required:
+            return False
+        return channel is self or seenOn is channel
 
-            tmp = serout.strip() #to log the device output unmodified
-            if(len(tmp) != 0):
-                self.log("DEV", repr(serout))
-                self.queue_serread.put(tmp)
+    def handleDeviceLine(self, serout, conn=None):
+        """
+        Called by the receiver for each line (or partial line, on a read timeout) from the device.
+        """
+        if conn is None:
+            conn = self
+        tmp = serout.strip() #to log the device output unmodified
+        if(len(tmp) != 0):
+            #Every line, even the repeated ones
+            self.signatures_queue(tmp, conn)
+            if self.collapseRepeats is True and self.repeat_check(tmp, conn) is True:
+                return
+            self.log(self.log_tag("DEV", conn), repr(serout))
+            conn.queue_serread.put(tmp)
+
+    def repeat_setup(self):
+        self.noise = [re.compile(pattern) for pattern in self.noisePatterns]
+        self.repeat = {"key": None, "count": 0, "first": None, "last": None, "relevant": False}
+
+    def repeat_check(self, line, conn):
+        """
+        Repeated line suppressor (collapseRepeats option). Returns True if the line repeats the previous one (same
+        text or same noise pattern) and was handled here. Repeats are only sent to the state watcher if they contain
+        a marker, the log gets a summary when the repeats stop.
+        """
+        key = line
+        for pattern in self.noise:
+            if pattern.search(line) is not None:
+                key = pattern
+                break
+
+        rep = conn.repeat
+        if rep["key"] == key:
+            if rep["count"] == 0:
+                rep["first"] = self.clock.now()
+            rep["count"] += 1
+            rep["last"] = self.clock.now()
+
+            #Noise lines are not identical, check each one
+            if type(key) is not str:
+                rep["relevant"] = self.repeat_relevant(line, conn)
+            if rep["relevant"] is True:
+                conn.queue_serread.put(line)
+            return True
 
-        self.sock_close(self.mainSocket)
+        self.repeat_flush(conn)
+        rep["key"] = key
+        rep["relevant"] = self.repeat_relevant(line, conn)
+        return False
+
+    def repeat_relevant(self, line, conn):
+        markers = conn.statewatcher_markers
+        for marker in markers:
+            if marker in line:
+                return True
+        return False
+
+    def repeat_flush(self, conn):
+        rep = conn.repeat
+        if rep["count"] == 0:
+            return
+        self.log(self.log_tag("DEV", conn), "last line repeated", rep["count"], "times, from", rep["first"], "to",
+                 rep["last"])
+        rep["count"] = 0
 
-    def thread_SerialWrite(self):
+    def thread_SerialWrite(self, conn=None):
         """
         Sender thread. 
         JOB: Sends commands to the device. Breaks large commands into pieces to not have problems with missing parts.
+        NOTE: conn is the channel to write to, the main one if not given.
         """
-        while self.run["send"] is True:
-            cmd = self.queue_serwrite.get(block=True)
-            cmd = str(cmd) #in case someone writes numbers in yml
+        if conn is None:
+            conn = self
+        run = self.thread_name("send", conn)
+
+        while self.run[run] is True:
+            cmd = conn.queue_serwrite.get(block=True)
             if cmd is None:
                 break
-            else:
-                lcmd = len(cmd)
+            cmd = str(cmd) #in case someone writes numbers in yml
+            lcmd = len(cmd)
 
             #Skip endline for y/n stuff
             #NOTE: also works for 0 len cmds for sending an CR
             if lcmd != 1:
-                cmd += self.eol[self.sendendr]
+                cmd += conn.eol[conn.sendendr]
+
+            #Before sending, the device might answer before we get back here
+            if self.echoPrompts is True and len(cmd.strip()) != 0:
+                conn.echo.append(cmd.strip())
 
             while True:
                 try:
                     #Improve handling of large commands sent to the device
                     if lcmd > self.largeCommand:
                         lim = int((lcmd/2)-1)
-                        self.mainSocket.sendall(cmd[0:lim].encode())
-                        time.sleep(0.25)
-                        self.mainSocket.sendall(cmd[lim:].encode())
+                        conn.mainSocket.sendall(cmd[0:lim].encode())
+                        self.clock.sleep(0.25)
+                        conn.mainSocket.sendall(cmd[lim:].encode())
                     else:
-                        self.mainSocket.sendall(cmd.encode())
+                        conn.mainSocket.sendall(cmd.encode())
                     break #Exit loop
                 except OSError:
                     #Loop until socket is back
+                    if self.clock.cancelled():
+                        break
                     self.log("Waiting for socket to send stuff")
-                    time.sleep(1)
+                    self.clock.sleep(1)
                     continue
 
-            self.log("SENT", repr(cmd))
+            self.log(self.log_tag("SENT", conn), repr(cmd))
         
 
-    def thread_StateWatcher(self): 
+    def thread_StateWatcher(self, conn=None): 
         """
         STATE WATCHER: looks for the current state of the device
+        NOTE: there is one for each channel, all of them publish the states in the same queue
         """
-        while(self.run["state_watcher"] is True):
-            serout = self.getDeviceOutput()
+        if conn is None:
+            conn = self
+        run = self.thread_name("state_watcher", conn)
+
+        while(self.run[run] is True):
+            serout = self.getDeviceOutput(conn)
             
             #Speed things up a bit
             if serout == "":
                 continue
 
-            for marker in self.statewatcher_markers:
-                match = False
-                if self.statewatcher_markers[marker] not in self.prompts:
-                    #If marker is not a prompt, just look for it in the output
-                    if marker in serout:
-                        match = True
-                else:
-                    #If the marker is a prompt, we need to make sure we don't also
-                    #consider it when it is part of a command sent to the device. So
-                    #we try to see if there is something after it.
-                    try:
-                        if len(serout.strip().split(marker)[1]) == 0:
+            #A reload swaps the markers, prompts and triggers, use the same version of the test for the entire line
+            with self.reload_lock:
+                markers = conn.statewatcher_markers
+
+                #Pipelined commands wait for their echo
+                with conn.echoLock:
+                    acked = len(conn.echoWait) != 0 and self.pipeline_echo(serout, conn.echoWait[0], conn) is True
+                    if acked is True:
+                        conn.echoWait.popleft()
+                if acked is True:
+                    self.updateDeviceState(ECHO_ACK, conn)
+
+                for marker in markers:
+                    match = False
+                    if markers[marker] not in conn.prompts:
+                        #If marker is not a prompt, just look for it in the output
+                        if marker in serout:
+                            match = True
+                    else:
+                        #If the marker is a prompt, we need to make sure we don't also
+                        #consider it when it is part of a command sent to the device. So
+                        #we try to see if there is something after it.
+                        try:
+                            rest = serout.strip().split(marker)[1].strip()
+                        except IndexError:
+                            continue
+                        if len(rest) == 0:
+                            match = True
+                        elif self.echoPrompts is True and rest in conn.echo:
+                            #Command sent before the prompt was printed
+                            conn.echo.remove(rest)
                             match = True
-                    except IndexError:
-                        continue
 
-                if match is True:
-                    current_state = self.statewatcher_markers[marker]
+                    if match is True:
+                        current_state = markers[marker]
 
-                    self.log("FOUND", current_state, "state in", serout)
+                        self.log("FOUND", current_state, "state in", serout)
+                        self.intervals_check(current_state)
+                        self.status["last"] = current_state
+                        self.status["transition"] = time.time()
+                        self.status_write()
 
-                    #Run the critical modifiers, if any are present for the state
-                    try:
-                        actions = self.triggers[current_state]
+                        #Run the critical modifiers, if any are present for the state
+                        actions = self.triggers.get(current_state, [])
                         for opt in actions:
                             if opt in self.critical_modifiers:
                                 self.modifiers[opt](current_state)
-                    except KeyError:
-                        pass
 
-                    #Notify everyone of the new state
-                    self.updateDeviceState(current_state)
+                        #The other flag modifiers also apply before the next line is matched (ex: IGNORE_STATES,
+                        #TRIGGER_STOP at a reboot marker)
+                        runTriggers = self.opt_RunTriggers
+                        if runTriggers is True:
+                            for opt in actions:
+                                if (opt in self.modifiers and opt not in self.critical_modifiers and
+                                        opt not in self.trigger_threadModifiers):
+                                    self.modifiers[opt](current_state)
+
+                        #Notify everyone of the new state
+                        self.updateDeviceState(current_state, conn)
+
+                        #Run the triggers of the state, in the trigger thread of the state, so we can keep on watching
+                        if runTriggers is True:
+                            try:
+                                self.queue_triggers[current_state].put((self.clock.monotonic(), conn))
+                            except KeyError:
+                                pass
+
+    def thread_Trigger(self, state):
+        """
+        TRIGGER thread, one for each state with triggers. Sends the commands of the triggers in order and runs the
+        modifiers that take time (SLEEP_RANDOM, COUNT). The flag modifiers are already handled by the state watcher.
+        """
+        while self.run["trigger " + state] is True:
+            found = self.queue_triggers[state].get(block=True)
+            if found is None:
+                break
+            found, channel = found
+
+            latency = self.clock.monotonic() - found
+            self.log("RUNNING TRIGGERS for", state, "( latency", round(latency, 3), "seconds )")
+            if latency > self.trigger_maxLatency:
+                self.trigger_maxLatency = latency
+                self.log("NEW MAX TRIGGER LATENCY", round(latency, 3), "seconds for", state)
 
-                    #Run the triggers of the state
-                    if self.opt_RunTriggers is True:
-                        try:
-                            for act in self.triggers[current_state]:
-                                if act not in self.modifiers.keys():
-                                    self.sendDeviceCmd(act)
-                                elif act not in self.critical_modifiers:
-                                    #Run the rest of the normal modifiers, in order
-                                    self.modifiers[act](current_state)
-                        except KeyError:
-                            pass
+            try:
+                for act in self.triggers[state]:
+                    if act not in self.modifiers.keys():
+                        self.sendDeviceCmd(act, channel)
+                    elif act in self.trigger_threadModifiers:
+                        self.modifiers[act](state)
+            except KeyError:
+                pass
+            except Exception:
+                #Keep the thread, the next time the state is found the triggers run again
+                self.log("TRIGGERS for", state, "failed:", traceback.format_exc())
 
     def thread_MyTest(self):
         """
         ACTUAL TEST thread. Looks for states and executes stuff.
         """
         test_len = len(self.test_seq)
-        test_idx = 0
+        test_idx = self.test_startIdx
 
-        while self.run["test"] is True:
+        self.checkpoint_write(test_idx)
+
+        #The config stopped the watchdog
+        self.mainTimer = self.timer_startTimer(self.mainTimer)
+
+        while self.run["test"] is True:
             if test_idx == test_len:
                 if self.infiniteTest is True:
+                    self.results_loop()
                     self.counter["test_loop"] += 1
                     self.counter["test_timeouts"] = self.test_max_timeouts #Reset the timeouts possible
                     self.log("GOT TO LOOP.....", self.counter["test_loop"])
+                    self.intervals_report()
+                    self.signatures_report()
+                    if self.memoryTrack is True:
+                        self.memory_check()
+                    if self.adaptiveTimeout is True:
+                        self.adaptive_loop()
+                    self.status_write()
                     test_idx = 0
+
+                    if self.hotReload is True and self.reload_test() is True:
+                        test_len = len(self.test_seq)
+
+                    if self.checkpointLoops != 0 and self.counter["test_loop"] % self.checkpointLoops == 0:
+                        self.checkpoint_write(test_idx)
+
+                    if self.logRotateLoops != 0 and (self.counter["test_loop"] - 1) % self.logRotateLoops == 0:
+                        with self.file_test.lock:
+                            self.log_rotate()
+                    else:
+                        self.file_test.flush() #each loop can be read from the compressed log
                 else:
                     break
 
-            required_state = self.test_seq[test_idx]
+            channel, required_state = self.step_channel(self.test_seq[test_idx])
 
             #
             ##  See if we need to wait for some user input
@@ -498,22 +1889,33 @@ class Overwatcher():
                 if self.tossCoin() is True:
                     self.log("RUNNING ACTIONS:", required_state, "=", self.actions[required_state])
                     for elem in self.actions[required_state]:
+                        #Pipelined commands are done before the modifiers
+                        if self.mod_Pipeline is True and elem in self.modifiers:
+                            self.pipeline_flush(channel)
                         #Run any modifiers in actions
                         try:
                             self.modifiers[elem](required_state)
                             continue
                         except KeyError:
                             pass
-                        if self.mod_RunLocal is False:
-                            self.sendDeviceCmd(elem)
-                            self.waitDevicePrompt(elem)
+                        if self.mod_Pipeline is True:
+                            self.pipeline_send(elem, channel)
+                        elif self.mod_RunLocal is False:
+                            if self.mod_Capture is True and channel is self:
+                                self.capture_start(required_state, elem)
+                            self.sendDeviceCmd(elem, channel)
+                            self.waitDevicePrompt(elem, channel)
                         else:
                             self.runLocalCommand(elem)
+                    if self.mod_Pipeline is True:
+                        self.pipeline_flush(channel)
                     test_idx += 1
 
                     # Revert back to defaults
+                    self.d_Pipeline(required_state)
                     self.e_PromptWait(required_state)
                     self.d_runLocal(required_state)
+                    self.d_Capture(required_state)
                 continue
             except KeyError:
                 pass
@@ -537,15 +1939,25 @@ class Overwatcher():
                 pass
 
             self.log("Looking for:", self.test_seq[test_idx]) #idx might change
-            current_state = self.getDeviceState()
+            self.status["required"] = required_state
+            self.status_write()
+            if self.adaptiveTimeout is True:
+                self.adaptive_arm(test_idx, required_state)
+            current_state, seenOn = self.getDeviceStateChannel()
 
             if self.opt_IgnoreStates is True:
                 self.log("IGNORED STATE", current_state)
                 continue
 
+            if current_state == ECHO_ACK:
+                #Late echo of a pipelined command
+                continue
+
             # If the required state is found 
-            if required_state == current_state:
+            if self.step_seen(channel, required_state, current_state, seenOn) is True:
                 self.log("MOVED TO STATE=", required_state)
+                if self.adaptiveTimeout is True:
+                    self.adaptive_learn(test_idx, required_state)
                 test_idx += 1
 
 
@@ -561,7 +1973,8 @@ class Overwatcher():
                 if self.strictStates is False or ignore is True:
                     self.log("STATE", current_state, "unexpected, but welcomed")
                 elif ignore is False:
-                    self.log("FOUND=", current_state, ", BUT WAS LOOKING FOR:", required_state)
+                    self.log("FOUND=", self.log_tag(current_state, seenOn), ", BUT WAS LOOKING FOR:",
+                             self.test_seq[test_idx])
                     self.mytest_failed()
 
             #TIMEOUT until next state
@@ -569,6 +1982,170 @@ class Overwatcher():
 
         self.mytest_ok()
 
+    def load_setup(self):
+        """
+        Checks the load section of the test, fails before connecting if something is wrong
+        """
+        mix = dict(self.load.get("mix") or {})
+        if len(mix) == 0:
+            raise ValueError("Load mix: the load section needs a 'mix' of actions")
+
+        self.load_actions = [] #(channel name, None for the main one, action)
+        self.load_weights = []
+        for step in mix:
+            #The channels are not open yet, only their names are known
+            channel, action = None, step
+            if "/" in step and step.split("/", 1)[0] in self.channels_cfg:
+                channel, action = step.split("/", 1)
+            if action not in self.actions or len(self.actions[action]) == 0:
+                raise ValueError("Load mix: unknown or empty action " + str(step))
+            for elem in self.actions[action]:
+                if elem in self.modifiers:
+                    raise ValueError("Load mix: action " + str(step) + " uses modifier " + elem)
+            self.load_actions.append((channel, action))
+            self.load_weights.append(mix[step])
+
+        self.load_rate = float(self.load.get("rate", 0)) #commands per second, 0 for as fast as possible
+        self.load_window = int(self.load.get("window", 1)) #commands sent without a prompt, per channel
+        self.load_duration = float(self.load.get("duration", 60))
+        self.load_count = int(self.load.get("count", 0)) #stop after this many commands, if not 0
+        self.load_timeout = float(self.load.get("timeout", 10)) #seconds, a command without a prompt is lost after it
+        if self.load_window < 1:
+            raise ValueError("Load window should be at least 1")
+        if self.load_timeout <= 0:
+            raise ValueError("Load timeout should be more than 0")
+
+        #Results, logged at the end even if the test is stopped
+        self.load_sent = 0
+        self.load_done = 0
+        self.load_lost = 0
+        self.load_latency = {} #command : IntervalStats
+        self.load_start = None
+
+    def load_tick(self):
+        """
+        Pacing timer of the load mode, wakes up the load thread to send the next command
+        """
+        self.updateDeviceState(LOAD_TICK)
+
+    def load_expire(self):
+        self.updateDeviceState(LOAD_EXPIRE)
+
+    def load_report(self):
+        """
+        Logs the results of the load mode, once. Called at the end of the load and when the test is stopped.
+        """
+        if self.loadMode is False or self.load_start is None:
+            return
+        elapsed = self.clock.monotonic() - self.load_start
+        self.load_start = None
+        self.log("LOAD RESULT: sent", self.load_sent, "commands, got", self.load_done, "prompts,", self.load_lost,
+                 "lost, in", round(elapsed, 3), "seconds")
+        if elapsed != 0:
+            self.log("LOAD RESULT:", round(self.load_done / elapsed, 3), "commands/sec")
+        for cmd in list(self.load_latency):
+            self.log("LOAD LATENCY", repr(cmd), ":", self.load_latency[cmd].summary())
+
+    def thread_Load(self):
+        """
+        LOAD MODE thread, runs instead of the test. Sends commands from a weighted mix of actions at a target rate,
+        with up to 'window' commands waiting for a prompt on each channel. Each prompt ends the oldest command of its
+        channel, the time between the two is the latency of the command. Commands without a prompt after the load
+        timeout are counted as lost, so a saturated device does not stop the load.
+        """
+        self.log("LOAD START: mix", self.load.get("mix"), "rate", self.load_rate, "window", self.load_window,
+                 "duration", self.load_duration, "count", self.load_count)
+
+        pending = [] #commands of the current action still to send
+        pendingChannel = self
+        waiting = {} #channel : [ (command, send time) ] waiting for a prompt
+        latency = self.load_latency
+        start = self.clock.monotonic()
+        self.load_start = start
+        stopping = False
+        credit = 1 #commands that can be sent now, given by the pacing timer
+        ticker = None
+        expiry = None #timer for the oldest command waiting
+
+        while self.run["test"] is True:
+            now = self.clock.monotonic()
+            if stopping is False:
+                if self.load_count != 0 and self.load_sent >= self.load_count:
+                    stopping = True
+                elif now - start >= self.load_duration:
+                    stopping = True
+
+            if stopping is True and sum(len(elem) for elem in waiting.values()) == 0:
+                break
+
+            #Send as much as the window and the rate allow
+            while stopping is False and credit > 0:
+                #The commands of an action are sent in order, before drawing the next action
+                if len(pending) == 0:
+                    name, action = self.rand.choices(self.load_actions, weights=self.load_weights)[0]
+                    pendingChannel = self.channels[name] if name is not None else self
+                    pending = list(self.actions[action])
+                    if len(pending) == 0:
+                        continue
+
+                if len(waiting.setdefault(pendingChannel, [])) >= self.load_window:
+                    break
+
+                cmd = pending.pop(0)
+                self.sendDeviceCmd(cmd, pendingChannel)
+                waiting[pendingChannel].append((cmd, self.clock.monotonic()))
+                self.load_sent += 1
+                if self.load_rate != 0:
+                    credit -= 1
+                if self.load_count != 0 and self.load_sent >= self.load_count:
+                    break
+
+            if self.load_rate != 0 and credit == 0 and ticker is None and stopping is False:
+                ticker = self.clock.Timer(1.0 / self.load_rate, self.load_tick)
+                ticker.start()
+
+            oldest = [elem[0][1] for elem in waiting.values() if len(elem) != 0]
+            if expiry is None and len(oldest) != 0:
+                expiry = self.clock.Timer(max(min(oldest) + self.load_timeout - self.clock.monotonic(), 0.01),
+                                         self.load_expire)
+                expiry.start()
+
+            state, channel = self.getDeviceStateChannel()
+            self.mainTimer = self.timer_startTimer(self.mainTimer)
+            if state == LOAD_TICK:
+                ticker = None
+                credit += 1
+                continue
+            if state == LOAD_EXPIRE:
+                expiry = None
+                now = self.clock.monotonic()
+                for conn in waiting:
+                    while len(waiting[conn]) != 0 and now - waiting[conn][0][1] >= self.load_timeout:
+                        cmd, sendTime = waiting[conn].pop(0)
+                        self.load_lost += 1
+                        self.log("LOAD LOST", repr(cmd), "no prompt after", self.load_timeout, "seconds")
+                continue
+            if state == "":
+                continue
+
+            if state not in channel.prompts or len(waiting.get(channel, [])) == 0:
+                self.log("STATE", state, "during load")
+                continue
+
+            cmd, sendTime = waiting[channel].pop(0)
+            duration = self.clock.monotonic() - sendTime
+            if cmd not in latency:
+                latency[cmd] = IntervalStats(cmd, None, None)
+            latency[cmd].add(duration)
+            self.load_done += 1
+
+        for timer in [ticker, expiry]:
+            if timer is not None:
+                timer.cancel()
+
+        self.load_report()
+        self.mytest_ok()
+
     """
     -----------------------------------------INTERNAL APIs
     """
@@ -627,21 +2204,212 @@ class Overwatcher():
         self.log("RUNNING ON DEVICE")
         self.mod_RunLocal = False
 
+    def e_Capture(self, state):
+        self.log("CAPTURING COMMAND OUTPUT TO FILES!")
+        self.mod_Capture = True
+
+    def d_Capture(self, state):
+        if self.mod_Capture is True:
+            self.log("STOP CAPTURING COMMAND OUTPUT")
+            self.mod_Capture = False
+
+    def e_Pipeline(self, state):
+        """
+        PIPELINE modifier: the next commands of the action are sent as soon as the echo of the previous one is seen,
+        with up to pipelineDepth commands waiting for a prompt. Unsafe actions stay sequential.
+        """
+        action = self.actions.get(state, [])
+        unsafe = [elem for elem in action if elem in self.pipeline_unsafeModifiers]
+        if state in self.pipelineUnsafe or len(unsafe) != 0:
+            self.log("PIPELINE ignored, action", state, "is unsafe", unsafe)
+            return
+        self.log("PIPELINING COMMANDS, DEPTH", self.pipelineDepth)
+        self.mod_Pipeline = True
+        #Prompts are followed by the echo of the next command only while pipelining
+        self.echoPrompts = True
+
+    def d_Pipeline(self, state):
+        if self.mod_Pipeline is True:
+            self.log("STOP PIPELINING COMMANDS")
+            self.mod_Pipeline = False
+            if self.loadMode is False:
+                self.echoPrompts = False
+                for channel in [self] + list(self.channels.values()):
+                    channel.echo.clear()
+
+    def pipeline_echo(self, serout, echo, channel):
+        """
+        True if the line is the echo of the command, alone or right after a prompt
+        """
+        line = serout.strip()
+        if line == echo:
+            return True
+        if line.endswith(echo) is False:
+            return False
+        before = line[:-len(echo)].rstrip()
+        for marker in channel.statewatcher_markers:
+            if channel.statewatcher_markers[marker] in channel.prompts and before.endswith(marker.strip()):
+                return True
+        return False
+
+    def pipeline_send(self, cmd, channel):
+        """
+        Sends a pipelined command, after the echo of the previous one and when there is room in the pipeline
+        """
+        self.pipeline_wait(channel, self.pipelineDepth - 1)
+        cmd = str(cmd)
+        #An empty command (CR) has no echo to wait for
+        echo = cmd.strip()
+        if len(echo) != 0:
+            with channel.echoLock:
+                channel.echoWait.append(echo)
+        self.pipeline.append([cmd, len(echo) == 0])
+        self.sendDeviceCmd(cmd, channel)
+
+    def pipeline_flush(self, channel):
+        """
+        Waits for the prompts of all the pipelined commands
+        """
+        self.pipeline_wait(channel, 0)
+
+    def pipeline_wait(self, channel, maxWaiting):
+        """
+        Handles echos and prompts until the last command sent was echoed and at most maxWaiting commands wait for a
+        prompt. Each prompt ends the oldest command. Other states are put back, like in waitDevicePrompt.
+        """
+        skipped = []
+        while self.opt_IgnoreStates is False and self.run["test"] is True:
+            unacked = [elem for elem in self.pipeline if elem[1] is False]
+            if len(unacked) == 0 and len(self.pipeline) <= maxWaiting:
+                self.putbackDeviceStates(skipped)
+                return
+
+            state, seenOn = self.getDeviceStateChannel()
+            if state == "":
+                return
+            if seenOn is not channel:
+                skipped.append((state, seenOn))
+            elif state == ECHO_ACK:
+                if len(unacked) != 0:
+                    unacked[0][1] = True
+            elif state in channel.prompts:
+                if len(self.pipeline) == 0:
+                    continue
+                cmd, acked = self.pipeline.pop(0)
+                if acked is False:
+                    #No echo (ex: passwords), the prompt is enough
+                    with channel.echoLock:
+                        if len(channel.echoWait) != 0:
+                            channel.echoWait.popleft()
+                self.log("Found prompt for", repr(cmd), ",", len(self.pipeline), "commands still waiting")
+            else:
+                skipped.append((state, seenOn))
+
+        self.putbackDeviceStates(skipped)
+        self.pipeline = []
+        with channel.echoLock:
+            channel.echoWait.clear()
+
+    def capture_start(self, action, cmd):
+        """
+        Everything the device sends until the next prompt goes to a separate file (CAPTURE modifier). The lines are
+        not logged or matched, only a summary is logged at the end.
+        """
+        self.capture_count += 1
+        fname = (self.name + "_capture_" + str(self.counter["test_loop"]) + "_" + str(action) + "_" +
+                 str(self.capture_count) + ".log")
+        prompts = [marker for marker in self.statewatcher_markers if self.statewatcher_markers[marker] in self.prompts]
+
+        self.log("CAPTURING output of", repr(cmd), "to", fname)
+        with self.capture_lock:
+            self.capture = {
+                            "name": fname,
+                            "file": open(fname, "wb"),
+                            "cmd": cmd,
+                            "prompts": prompts,
+                            "pending": b"", #last line, not finished yet
+                            "bytes": 0,
+                            "lines": 0,
+                            "start": self.clock.monotonic()
+                           }
+
+    def capture_data(self, data):
+        """
+        Called by the reader with the raw data while capturing. Returns the data that should still be processed
+        normally (the prompt line, once it is seen).
+        """
+        with self.capture_lock:
+            cap = self.capture
+            if cap is None:
+                return data
+
+            data = cap["pending"] + data
+            end = data.rfind(b"\n")
+            if end >= 0:
+                self.signatures_queueRaw(data[:end + 1], self)
+                cap["file"].write(data[:end + 1])
+                cap["bytes"] += end + 1
+                cap["lines"] += data.count(b"\n", 0, end + 1)
+                data = data[end + 1:]
+
+            #Prompt at the end of the last line, only the end is decoded
+            text = data.rstrip()[-CAPTURE_TAIL:].decode('ascii', errors='ignore').strip()
+            for prompt in cap["prompts"]:
+                if text.endswith(prompt):
+                    cap["pending"] = b""
+                    self.capture_stop_locked()
+                    return data
+
+            if len(data) > CAPTURE_PENDING_MAX:
+                #Output without newlines, keep only what a prompt check needs
+                end = len(data) - CAPTURE_TAIL
+                self.signatures_queueRaw(data[:end], self)
+                cap["file"].write(data[:end])
+                cap["bytes"] += end
+                data = data[end:]
+
+            cap["pending"] = data
+            return b""
+
+    def capture_stop(self, reason="prompt found"):
+        with self.capture_lock:
+            self.capture_stop_locked(reason)
+
+    def capture_stop_locked(self, reason="prompt found"):
+        cap = self.capture
+        if cap is None:
+            return
+        self.capture = None
+
+        self.signatures_queueRaw(cap["pending"], self)
+        cap["file"].write(cap["pending"])
+        cap["file"].close()
+        duration = self.clock.monotonic() - cap["start"]
+        self.log("CAPTURED", repr(cap["cmd"]), ":", cap["bytes"] + len(cap["pending"]), "bytes,", cap["lines"],
+                 "lines in", round(duration, 3), "seconds to", cap["name"], "(", reason, ")")
+
     def runLocalCommand(self, command):
         res = subprocess.call(command, shell=True)
         #TODO: retain full command output
         self.log("Command" + command + " return status " + str(res))
 
     def countTrigger(self, state):
-        try:
-            self.counter[state] += 1
-        except KeyError:
-            self.counter[state] = 1
+        with self.counter_lock:
+            try:
+                self.counter[state] += 1
+            except KeyError:
+                self.counter[state] = 1
+        counters = self.counter_snapshot()
 
-        self.log("COUNTING for \'" + state + "\'...got to ", self.counter[state])
+        self.log("COUNTING for \'" + state + "\'...got to ", counters[state])
+        self.status_write()
         #Display all counting stats everytime:
-        for elem in self.counter:
-            self.log("COUNT FOR", elem, "is", self.counter[elem])
+        for elem in counters:
+            self.log("COUNT FOR", elem, "is", counters[elem])
+
+    def counter_snapshot(self):
+        with self.counter_lock:
+            return dict(self.counter)
 
     def timeCommand(self, state):
         self.log("TIMING NEXT COMMAND")
@@ -651,37 +2419,41 @@ class Overwatcher():
         self.log("State", state, "treated as NOT STRICT!")
 
     def sleepRandom(self, state):
-        duration = random.randint(self.sleep_min, self.sleep_max)
+        duration = self.rand.randint(self.sleep_min, self.sleep_max)
         self.log("ZzzzZZzzzzzzZzzzz....(", duration, "seconds )....")
-        time.sleep(duration)
+        self.clock.sleep(duration)
         self.log("....WAKE UP!")
 
     def tossCoin(self):
         if self.opt_RandomExec is False:
             return True
         else:
-            ret = random.choice([True, False])
+            ret = self.rand.choice([True, False])
             self.log("Random coin toss showed", ret)
             return ret
 
-    def getDeviceOutput(self):
+    def getDeviceOutput(self, channel=None):
         """
         Wrapper over serial receive queue. Blocks until data is available.
 
         Returns "" if queue is closing.
         """
-        serout = self.queue_serread.get(block=True)
-        self.queue_serread.task_done()
+        if channel is None:
+            channel = self
+        serout = channel.queue_serread.get(block=True)
+        channel.queue_serread.task_done()
         if serout is None:
             return ""
         else:
             return serout
 
-    def sendDeviceCmd(self, cmd):
+    def sendDeviceCmd(self, cmd, channel=None):
         """
-        Wrapper over serial send queue.
+        Wrapper over serial send queue. Sends on the main channel if none is given.
         """
-        self.queue_serwrite.put(cmd)
+        if channel is None:
+            channel = self
+        channel.queue_serwrite.put(cmd)
 
 
     def getDeviceState(self):
@@ -690,53 +2462,81 @@ class Overwatcher():
 
         Returns "" if queue is closing.
         """
-        state = self.queue_state.get(block=True)
+        return self.getDeviceStateChannel()[0]
+
+    def getDeviceStateChannel(self):
+        """
+        Same as getDeviceState, also returns the channel the state was seen on (None if the queue is closing)
+        NOTE: only the test thread reads the states
+        """
+        if len(self.state_putback) != 0:
+            return self.state_putback.popleft()
+        elem = self.queue_state.get(block=True)
         self.queue_state.task_done()
-        if state is None:
-            return ""
+        if elem is None:
+            #Closed for everyone waiting, not just the first one
+            self.queue_state.put(None)
+            return "", None
         else:
-            return state
+            return elem
+
+    def putbackDeviceStates(self, states):
+        """
+        Gives back the states a prompt wait skipped. They are read again first, in the order they were seen.
+        NOTE: the wait blocks on the queue instead of putting them back one by one and polling, which would spin
+        (and make the virtual time run away) while the prompt is not there
+        """
+        self.state_putback.extendleft(reversed(states))
 
-    def waitDevicePrompt(self, cmd):
+    def waitDevicePrompt(self, cmd, channel=None):
         """
         Wait until we see something defined as a device prompt. All other states 
-        are ignored and put back in the queue. Prompts are consumed.
+        are ignored and given back (read again first, in order). Prompts are consumed.
         This now blocks until it sees a prompt. If the timeout is triggered we 
         try a recovery and wait again, which should also help this. If it does 
         not, something bad happened.
+        NOTE: the prompts are the ones of the channel (main one if not given)
         """
+        if channel is None:
+            channel = self
+
         if self.mod_PromptWait is True:
             self.log("Waiting for prompt for elem", cmd)
         else:
-            time.sleep(1)
+            self.clock.sleep(1)
             return
 
         #Here we time the command from start
         if self.opt_TimeCmd is True:
-            startOfPromptWait = datetime.datetime.now()
+            startOfPromptWait = self.clock.now()
 
+        skipped = []
         while self.opt_IgnoreStates is False:
-            #Look just for prompts, put everything else back
-            state = self.getDeviceState()
-            if state in self.prompts:
+            #Look just for prompts of the channel, put everything else back
+            state, seenOn = self.getDeviceStateChannel()
+            if state in channel.prompts and seenOn is channel:
                 self.log("Found prompt!")
                 break
+            elif state == "":
+                #Test ending
+                break
             else:
-                self.updateDeviceState(state)
-
-            time.sleep(0.2)
+                skipped.append((state, seenOn))
+        self.putbackDeviceStates(skipped)
 
         #Until the prompt wait is over
         if self.opt_TimeCmd is True:
             self.opt_TimeCmd = False
-            endOfPromptWait = datetime.datetime.now()
+            endOfPromptWait = self.clock.now()
             self.log("Command", repr(cmd), "took", str(endOfPromptWait - startOfPromptWait))
 
-    def updateDeviceState(self, state):
+    def updateDeviceState(self, state, channel=None):
         """
-        Wrapperr over state queue.
+        Wrapperr over state queue. The states are queued with the channel they were seen on (main one if not given).
         """
-        self.queue_state.put(state)
+        if channel is None:
+            channel = self
+        self.queue_state.put((state, channel))
 
     def getResult(self, block=True):
         """
@@ -767,25 +2567,37 @@ class Overwatcher():
         """
         Wrapper over result queue. Does some filtering of the final message.
         """
+        with self.result_lock:
+            if self.result_final is None:
+                self.result_final = res
+                self.status["result"] = str(res)
+        self.status_write()
+        #What led to the result is the most important part of the log, do not keep it in memory
+        self.file_test.flush()
         try:
             self.queue_result.put_nowait(res)
         except queue.QueueFull:
             print("FAILED TO SET RESULT")
             pass
 
-    def timer_startTimer(self, timer):
+    def timer_startTimer(self, timer, interval=None):
         """
         Starts or restarts a timer using the class options (timeout and mytest_timeout)
+        NOTE: interval is only given by the adaptive watchdog, it keeps the time the watchdog was (re)started
         """
-        if self.timeout == 0:
-            self.log("Test has no timeout!")
-            return None
+        if interval is None:
+            if self.timeout == 0:
+                self.log("Test has no timeout!")
+                return None
+            interval = self.timeout
+            self.adaptive_start = self.clock.monotonic()
+            self.adaptive_armed = None
 
         try:
             if timer is not None:
                 timer.cancel()
                 del timer
-            timer = threading.Timer(self.timeout, self.mytest_timeout)
+            timer = self.clock.Timer(interval, self.mytest_timeout)
             timer.start()
         except UnboundLocalError:
             self.log("ERROR starting timer!")
@@ -808,32 +2620,229 @@ class Overwatcher():
 
         return None
 
-    def sock_create(self):
-        if self.telnetTest is True and self.sleep_sockWait != 0:
-            #On telnet it might close before the IGNORE STATES part
-            self.e_IgnoreStates(None)
-            self.d_RunTriggers(None)
-            time.sleep(self.sleep_sockWait) #wait a bit before restarting connection
+    def telnet_reset(self, conn):
+        """
+        Forget the telnet state of a channel, called for each new connection
+        """
+        conn.telnet_partial = b"" #command split between two reads
+        conn.telnet_local = {} #options we do
+        conn.telnet_remote = {} #options the device does
+
+    def telnet_send(self, s, *args):
+        try:
+            s.sendall(bytes([TELNET_IAC] + list(args)))
+        except OSError:
+            pass
+
+    def telnet_filter(self, s, data, conn=None):
+        """
+        Removes the telnet commands from the data read from the device and answers them. Works on entire chunks, a
+        command split between two reads is kept for the next one.
+        """
+        if conn is None:
+            conn = self
+        data = conn.telnet_partial + data
+        conn.telnet_partial = b""
+
+        #Speed things up a bit, most chunks have no commands
+        if TELNET_IAC not in data:
+            return data.replace(b"\0", b"") #CR NUL is just CR
+
+        out = bytearray()
+        idx = 0
+        dlen = len(data)
+        while idx < dlen:
+            iac = data.find(TELNET_IAC, idx)
+            if iac < 0:
+                out += data[idx:]
+                break
+            out += data[idx:iac]
+
+            if iac + 1 >= dlen:
+                conn.telnet_partial = data[iac:]
+                break
+
+            cmd = data[iac + 1]
+            if cmd == TELNET_IAC:
+                #Escaped data byte
+                out.append(TELNET_IAC)
+                idx = iac + 2
+            elif cmd in (TELNET_WILL, TELNET_WONT, TELNET_DO, TELNET_DONT):
+                if iac + 2 >= dlen:
+                    conn.telnet_partial = data[iac:]
+                    break
+                self.telnet_negotiate(s, cmd, data[iac + 2], conn)
+                idx = iac + 3
+            elif cmd == TELNET_SB:
+                #No accepted option has subnegotiations, skip them
+                end = data.find(bytes([TELNET_IAC, TELNET_SE]), iac + 2)
+                if end < 0:
+                    conn.telnet_partial = data[iac:]
+                    break
+                idx = end + 2
+            else:
+                #NOP (keepalive), GA, DM and the rest need no answer
+                idx = iac + 2
+
+        return bytes(out).replace(b"\0", b"")
+
+    def telnet_negotiate(self, s, cmd, opt, conn):
+        """
+        Option negotiation. Only answer when the state of an option changes, so we never loop with the device.
+        """
+        if cmd == TELNET_WILL:
+            if opt in conn.telnet_remoteOptions:
+                if conn.telnet_remote.get(opt) is not True:
+                    conn.telnet_remote[opt] = True
+                    self.telnet_send(s, TELNET_DO, opt)
+            else:
+                self.telnet_send(s, TELNET_DONT, opt)
+        elif cmd == TELNET_WONT:
+            if conn.telnet_remote.get(opt) is True:
+                conn.telnet_remote[opt] = False
+                self.telnet_send(s, TELNET_DONT, opt)
+        elif cmd == TELNET_DO:
+            if opt == TELNET_TIMING_MARK:
+                #Keepalive, always answer
+                self.telnet_send(s, TELNET_WILL, opt)
+            elif opt in conn.telnet_localOptions:
+                if conn.telnet_local.get(opt) is not True:
+                    conn.telnet_local[opt] = True
+                    self.telnet_send(s, TELNET_WILL, opt)
+            else:
+                self.telnet_send(s, TELNET_WONT, opt)
+        elif cmd == TELNET_DONT:
+            if conn.telnet_local.get(opt) is True:
+                conn.telnet_local[opt] = False
+                self.telnet_send(s, TELNET_WONT, opt)
+
+    def sock_create(self, conn=None):
+        """
+        Opens the connection of a channel (main one if not given)
+        NOTE: only the main channel changes the modifiers on reconnects
+        """
+        if conn is None:
+            conn = self
+
+        if conn.telnetTest is True and self.sleep_sockWait != 0:
+            if conn is self:
+                #On telnet it might close before the IGNORE STATES part
+                self.e_IgnoreStates(None)
+                self.d_RunTriggers(None)
+            self.clock.sleep(self.sleep_sockWait) #wait a bit before restarting connection
+
+        if conn.ttyDevice is not None:
+            return self.tty_create(conn)
 
-        self.log("Opening socket")
+        self.log("Opening socket", self.thread_name("", conn))
         connected = False
         while not connected: 
+            slots = self.connect_acquire(conn)
+            if self.clock.cancelled():
+                self.connect_release(slots)
+                raise TestStopped("test ending, not connecting to " + str(conn.server) + ":" + str(conn.port))
             s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect((self.server, self.port))
-            time.sleep(2)
-            if self.telnetTest is False:
-                #on serial, send an endl when creating the socket
-                s.sendall(self.eol[self.sendendr].encode())
-            connected = s.recv(1)
-
-        self.log("Socket online") 
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) #commands are small, do not wait for acks
+            s.settimeout(SOCK_CONNECT_TIMEOUT) #never block forever, the test might be ending
+            try:
+                try:
+                    s.connect((conn.server, conn.port))
+                finally:
+                    #The slot is only for the connect, a silent console must not keep the other tests waiting
+                    self.connect_release(slots)
+                if conn.telnetTest is True:
+                    #Ask for full duplex, the rest is answered by the reader
+                    self.telnet_reset(conn)
+                    conn.telnet_local[TELNET_SGA] = True
+                    conn.telnet_remote[TELNET_SGA] = True
+                    self.telnet_send(s, TELNET_DO, TELNET_SGA)
+                    self.telnet_send(s, TELNET_WILL, TELNET_SGA)
+                self.clock.sleep(2)
+                if conn.telnetTest is False:
+                    #on serial, send an endl when creating the socket
+                    s.sendall(conn.eol[conn.sendendr].encode())
+                connected = s.recv(1)
+                if conn.telnetTest is True:
+                    #Do not lose the start of a telnet command
+                    self.telnet_filter(s, connected, conn)
+            except socket.gaierror as err:
+                #Wrong name or no DNS, retrying will not help
+                self.log("Failed to connect to", conn.server, conn.port, ":", err)
+                s.close()
+                raise
+            except OSError as err:
+                #Busy terminal servers refuse connections, try again later
+                self.log("Failed to connect to", conn.server, conn.port, ":", err)
+
+            if not connected:
+                s.close()
+                self.clock.sleep(1)
+
+        self.log("Socket online", self.thread_name("", conn)) 
         s.setblocking(0)
         s.settimeout(1) #seconds
         
         #We might have missed something on serial
         #On telnet this is important
-        self.opt_IgnoreStates = False
-        self.opt_RunTriggers = True
+        if conn is self:
+            self.opt_IgnoreStates = False
+            self.opt_RunTriggers = True
+        return s
+
+    def connect_acquire(self, conn):
+        """
+        Waits for the connect scheduler, if there is one
+        """
+        if self.connect is None:
+            return None
+        try:
+            slots, jitter, waited = self.connect.acquire(conn.server, conn.port, self.clock)
+        except OSError as e:
+            self.log("CONNECT to", conn.server, conn.port, "without a slot, the connect scheduler failed:", e)
+            return None
+        self.log("CONNECT to", conn.server, conn.port, "after", round(jitter, 3), "s jitter and", round(waited, 3),
+                 "s waiting for a free slot")
+        return slots
+
+    def connect_release(self, slots):
+        if slots is not None:
+            self.connect.release(slots)
+
+    def tty_create(self, conn=None):
+        """
+        Same as sock_create, but for a local serial port
+        """
+        if conn is None:
+            conn = self
+
+        self.log("Opening tty", conn.ttyDevice, "at", conn.baud)
+        connected = False
+        while not connected:
+            if self.clock.cancelled():
+                raise TestStopped("test ending, not opening " + str(conn.ttyDevice))
+            try:
+                s = TtyPort(conn.ttyDevice, conn.baud)
+            except OSError:
+                self.log("Failed to open", conn.ttyDevice, ", trying again")
+                self.clock.sleep(1)
+                continue
+            #Like on ser2net, send an endl and wait for the device to answer
+            try:
+                s.settimeout(SOCK_CONNECT_TIMEOUT)
+                s.sendall(conn.eol[conn.sendendr].encode())
+                connected = s.recv(1)
+            except OSError:
+                connected = False
+            if not connected:
+                s.close()
+                self.clock.sleep(1)
+
+        self.log("Tty online")
+        s.settimeout(1) #seconds
+
+        if conn is self:
+            self.opt_IgnoreStates = False
+            self.opt_RunTriggers = True
         return s
 
     def sock_close(self, s):
@@ -842,6 +2851,474 @@ class Overwatcher():
             s.close()
             s = None
 
+    def intervals_setup(self):
+        """
+        Creates the statistics for the intervals in the test. Intervals that already exist keep their samples.
+        """
+        stats = {}
+        for name in self.intervals:
+            elem = self.intervals[name]
+            if name in self.interval_stats:
+                stats[name] = self.interval_stats[name]
+                stats[name].start = elem["start"]
+                stats[name].end = elem["end"]
+                stats[name].limit = elem.get("max")
+            else:
+                stats[name] = IntervalStats(name, elem["start"], elem["end"], elem.get("max"))
+        self.interval_stats = stats
+
+    def intervals_check(self, state):
+        """
+        Called by the state watcher for each state found. Starts or ends the intervals that use the state.
+        """
+        now = self.clock.monotonic()
+        for stats in list(self.interval_stats.values()):
+            if state == stats.end and stats.started is not None:
+                duration = now - stats.started
+                stats.started = None
+                stats.add(duration)
+                self.log("INTERVAL", stats.name, "took", round(duration, 3), "seconds")
+                if stats.limit is not None and duration > stats.limit:
+                    self.log("INTERVAL", stats.name, "took longer than", stats.limit, "seconds!")
+                    self.mytest_failed()
+            #Same state can end one interval and start the next one
+            if state == stats.start:
+                stats.started = now
+
+    def intervals_report(self):
+        for stats in list(self.interval_stats.values()):
+            self.log("INTERVAL STATS", stats.name, ":", stats.summary())
+
+    def memory_setup(self):
+        """
+        Memory tracking (memoryTrack option). Started as soon as the options are known, so the allocations of the
+        whole test are traced.
+        """
+        self.memory_snapshot = None
+        self.memory_history = [] #(rss, traced) at the end of each loop
+        if self.memoryTrack is True and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def memory_rss(self):
+        """
+        Resident memory of the process in bytes, 0 if it cannot be read
+        """
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def memory_queues(self):
+        sizes = {"state": self.queue_state.qsize(), "result": self.queue_result.qsize(),
+                 "serread": self.queue_serread.qsize(), "serwrite": self.queue_serwrite.qsize(),
+                 "triggers": sum(q.qsize() for q in list(self.queue_triggers.values()))}
+        for name in self.channels:
+            sizes["serread@" + name] = self.channels[name].queue_serread.qsize()
+            sizes["serwrite@" + name] = self.channels[name].queue_serwrite.qsize()
+        return sizes
+
+    def memory_check(self):
+        """
+        Called by the test thread at the end of each loop. Logs the RSS, the traced memory, the queue sizes and the
+        allocation sites that grew the most since the previous loop. Warns if the memory grew for memoryGrowthLoops
+        loops in a row.
+        """
+        rss = self.memory_rss()
+        traced = tracemalloc.get_traced_memory()[0]
+        self.log("MEMORY loop", self.counter["test_loop"] - 1, "rss", round(rss / 1048576, 1), "MB, traced",
+                 round(traced / 1048576, 1), "MB, counters", len(self.counter), ", queues", self.memory_queues())
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")])
+        if self.memory_snapshot is None:
+            top = snapshot.statistics("lineno")
+        else:
+            top = snapshot.compare_to(self.memory_snapshot, "lineno")
+        for stat in top[:self.memoryTop]:
+            frame = stat.traceback[0]
+            self.log("MEMORY site", frame.filename + ":" + str(frame.lineno), "size", stat.size, "count", stat.count,
+                     "growth", getattr(stat, "size_diff", stat.size))
+        self.memory_snapshot = snapshot
+
+        self.memory_history.append((rss, traced))
+        self.memory_history = self.memory_history[-(self.memoryGrowthLoops + 1):]
+        if len(self.memory_history) <= self.memoryGrowthLoops:
+            return
+        for idx in (0, 1):
+            values = [elem[idx] for elem in self.memory_history]
+            if all(values[i] < values[i + 1] for i in range(len(values) - 1)):
+                self.log("MEMORY WARNING:", ("rss", "traced")[idx], "grew for", self.memoryGrowthLoops,
+                         "loops in a row, from", values[0], "to", values[-1], "bytes")
+
+    def signatures_setup(self):
+        """
+        Loads the failure signature catalogs (signatures option, paths relative to the test file)
+        """
+        self.scanner = None
+        self.signature_counts = {}
+        self.signature_lock = threading.Lock()
+        self.signature_dropped = 0
+        self.queue_signatures = queue.Queue(maxsize=SIGNATURE_QUEUE_MAX)
+
+        paths = self.signatures
+        if type(paths) is str:
+            paths = [paths]
+        if len(paths) == 0:
+            return
+
+        catalog = {}
+        for path in paths:
+            if self.test_file is not None and not os.path.isabs(path):
+                path = os.path.join(os.path.dirname(os.path.abspath(self.test_file)), path)
+            with open(path, "r") as f:
+                catalog.update(yaml.safe_load(f) or {})
+        self.scanner = SignatureScanner(catalog)
+
+        if self.signatureFail is not None and self.signatureFail not in SEVERITIES:
+            raise ValueError("signatureFail should be one of " + str(SEVERITIES))
+
+    def signatures_queue(self, line, conn):
+        """
+        Sends a line to the scanner, never slows down the reader (the line is dropped and counted if the scanner is
+        too far behind)
+        """
+        if self.scanner is None:
+            return
+        try:
+            self.queue_signatures.put_nowait((conn, line))
+        except queue.Full:
+            self.signature_dropped += 1
+
+    def signatures_queueRaw(self, data, conn):
+        """
+        Same as signatures_queue for raw data with full lines, used for the captured output (it is not logged but
+        it is still scanned)
+        """
+        if self.scanner is None:
+            return
+        for line in data.decode('ascii', errors='ignore').splitlines():
+            line = line.strip()
+            if len(line) != 0:
+                self.signatures_queue(line, conn)
+
+    def thread_Signatures(self):
+        """
+        Failure signature scanner. Gets every line from the reader (also the captured ones) as soon as it is read, in
+        its own thread, so it never slows down the test. Hits are logged with the lines before them and counted.
+        """
+        context = {} #channel : last lines
+        while self.run["signatures"] is True:
+            try:
+                elem = self.queue_signatures.get(block=True, timeout=1)
+            except queue.Empty:
+                continue
+            if elem is None:
+                break
+            conn, line = elem
+
+            before = context.setdefault(conn, collections.deque(maxlen=self.signatureContext))
+            for name in self.scanner.match(line):
+                severity = self.scanner.severity[name]
+                with self.signature_lock:
+                    self.signature_counts[name] = self.signature_counts.get(name, 0) + 1
+                    count = self.signature_counts[name]
+                self.log(self.log_tag("SIGNATURE", conn), name, "(" + severity + ") count",
+                         count, "in", repr(line), "after", list(before))
+                if (self.signatureFail is not None and
+                        SEVERITIES.index(severity) >= SEVERITIES.index(self.signatureFail)):
+                    self.log("SIGNATURE", name, "is", severity, ", failing the test!")
+                    self.mytest_failed()
+            before.append(line)
+
+    def signatures_report(self):
+        if self.scanner is None:
+            return
+        with self.signature_lock:
+            counts = dict(self.signature_counts)
+        self.log("SIGNATURE COUNTS:", counts, ",", len(self.scanner), "signatures,",
+                 self.signature_dropped, "lines dropped")
+
+    def results_start(self):
+        """
+        Adds the run to the results database, with no result yet (so crashed runs are also there)
+        """
+        self.results_id = uuid.uuid4().hex
+        self.results_loopStart = self.clock.monotonic()
+        if self.results is None:
+            return
+
+        version = self.info.get("version")
+        if type(version) is list and len(version) != 0:
+            version = version[0]
+        device = self.ttyDevice
+        if device is None:
+            device = str(self.server) + ":" + str(self.port)
+        required = str(self.info.get("overwatcher revision required")) + " (running " + str(revision) + ")"
+
+        self.results.execute("INSERT INTO runs (id, test, test_file, sha256, device, version, revision, host, pid, "
+                             "seed, started, options, info) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (self.results_id, self.name, self.full_name, self.test_hash, device, str(version),
+                              required, socket.gethostname(), os.getpid(), self.seed, self.clock.time(),
+                              json.dumps(self.test_options, default=str), json.dumps(self.info, default=str)))
+
+    def results_loop(self):
+        """
+        Called by the test thread at the end of each loop, before the counters are reset
+        """
+        now = self.clock.monotonic()
+        duration = now - self.results_loopStart
+        self.results_loopStart = now
+        if self.results is None:
+            return
+        self.results.execute("INSERT INTO loops (run, loop, ended, duration, timeouts) VALUES (?, ?, ?, ?, ?)",
+                             (self.results_id, self.counter["test_loop"], self.clock.time(), duration,
+                              self.test_max_timeouts - self.counter["test_timeouts"]))
+
+    def results_end(self):
+        if self.results is None:
+            return
+
+        result = self.result_final
+        #A test that is not infinite has one loop, the whole test
+        if self.infiniteTest is False and result == "ok":
+            self.results_loop()
+        for stats in list(self.interval_stats.values()):
+            for duration in stats.samples:
+                self.results.execute("INSERT INTO intervals (run, name, duration) VALUES (?, ?, ?)",
+                                     (self.results_id, stats.name, duration))
+
+        counters = self.counter_snapshot()
+        self.results.execute("UPDATE runs SET ended = ?, result = ?, retval = ?, loops = ?, timeouts = ?, counters = ? "
+                             "WHERE id = ?",
+                             (self.clock.time(), result, self.retval.get(result), counters.get("test_loop"),
+                              self.counter_timeouts, json.dumps(counters, default=str), self.results_id))
+        if self.results.close(self.shutdownTimeout) is False:
+            self.log("RESULTS DB not written in", self.shutdownTimeout, "seconds, giving up")
+        else:
+            self.log("RESULTS saved in", self.results.path, "as run", self.results_id)
+
+    def adaptive_file(self):
+        return self.name + "_watchdog.json"
+
+    def adaptive_setup(self):
+        """
+        Adaptive watchdog (adaptiveTimeout option). The time from the (re)start of the watchdog to each state of the
+        test is learned over the first adaptiveLoops loops, then the watchdog of each step is armed at adaptiveFactor
+        times the adaptivePercentile of the learned values. The timeout option stays the ceiling. The learned profile is
+        saved and used from the start by the next runs, delete it to learn again. A profile saved for another version
+        of the test is not used.
+        """
+        self.adaptive_start = self.clock.monotonic()
+        self.adaptive_armed = None #step of the adaptive watchdog, if armed
+        self.adaptive_timedOut = False
+        self.adaptive_firstLoop = 1 #learning starts here
+        self.adaptive_samples = {} #step : [ seconds ]
+        self.adaptive_profile = {} #step : seconds
+        if self.adaptiveTimeout is not True:
+            return
+
+        try:
+            with open(self.adaptive_file(), "r") as f:
+                saved = json.load(f)
+            if saved["sha256"] != self.test_hash:
+                #The steps are "index state", on another test they point to other steps. The log is not open yet.
+                print("WATCHDOG profile", self.adaptive_file(), "is for another version of the test, learning again")
+                return
+            self.adaptive_profile = saved["steps"]
+        except (OSError, ValueError, KeyError):
+            return
+
+    def adaptive_reset(self):
+        """
+        Called after a hot reload, the steps changed. Learns again from the next loop.
+        """
+        self.adaptive_armed = None
+        self.adaptive_samples = {}
+        self.adaptive_profile = {}
+        self.adaptive_firstLoop = self.counter["test_loop"]
+
+    def adaptive_step(self, test_idx, state):
+        #The index is needed, the same state can be more than once in a test
+        return str(test_idx) + " " + str(state)
+
+    def adaptive_arm(self, test_idx, state):
+        """
+        Called before waiting for a state. Arms the watchdog at the learned time of the step, counted from the last
+        restart of the watchdog.
+        """
+        limit = self.adaptive_profile.get(self.adaptive_step(test_idx, state))
+        if limit is None or self.mainTimer is None:
+            return
+        remaining = self.adaptive_start + limit - self.clock.monotonic()
+        self.adaptive_armed = self.adaptive_step(test_idx, state)
+        self.mainTimer = self.timer_startTimer(self.mainTimer, max(remaining, 0.1))
+
+    def adaptive_learn(self, test_idx, state):
+        if self.adaptive_timedOut is True:
+            self.adaptive_timedOut = False
+            return
+        #Nothing to learn if the profile was loaded
+        if self.counter["test_loop"] - self.adaptive_firstLoop >= self.adaptiveLoops or len(self.adaptive_profile) != 0:
+            return
+        step = self.adaptive_step(test_idx, state)
+        self.adaptive_samples.setdefault(step, []).append(self.clock.monotonic() - self.adaptive_start)
+
+    def adaptive_loop(self):
+        """
+        Called at the end of each loop, builds and saves the profile when the learning loops are done
+        """
+        if self.counter["test_loop"] - self.adaptive_firstLoop != self.adaptiveLoops or len(self.adaptive_samples) == 0:
+            return
+
+        profile = {}
+        for step in self.adaptive_samples:
+            limit = percentile(self.adaptive_samples[step], self.adaptivePercentile) * self.adaptiveFactor
+            limit = max(limit, self.adaptiveMin)
+            if self.timeout != 0:
+                limit = min(limit, self.timeout)
+            profile[step] = round(limit, 3)
+            self.log("WATCHDOG step", step, "learned", len(self.adaptive_samples[step]), "samples, max",
+                     round(max(self.adaptive_samples[step]), 3), "s, watchdog at", profile[step], "s")
+        self.adaptive_profile = profile
+
+        saved = { "test": self.full_name, "sha256": self.test_hash, "loops": self.adaptiveLoops,
+                  "percentile": self.adaptivePercentile, "factor": self.adaptiveFactor, "steps": profile }
+        tmp = self.adaptive_file() + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(saved, f, indent=4)
+            os.replace(tmp, self.adaptive_file())
+        except (OSError, TypeError, ValueError) as e:
+            self.log("WATCHDOG profile not saved:", repr(e))
+            return
+        self.log("WATCHDOG profile saved in", self.adaptive_file())
+
+    def checkpoint_file(self):
+        return self.name + "_checkpoint.json"
+
+    def checkpoint_write(self, test_idx):
+        """
+        Saves the progress of an infinite test, so it can be continued with --resume. Only called on loop boundaries.
+        """
+        if self.infiniteTest is False or self.checkpointLoops == 0:
+            return
+
+        rstate = self.rand.getstate()
+        checkpoint = {
+                        "test": self.full_name,
+                        "sha256": self.test_hash,
+                        "time": str(self.clock.now()),
+                        "test_idx": test_idx,
+                        "counter": self.counter_snapshot(),
+                        "opt_RunTriggers": self.opt_RunTriggers,
+                        "opt_IgnoreStates": self.opt_IgnoreStates,
+                        "opt_RandomExec": self.opt_RandomExec,
+                        "seed": self.seed,
+                        "random": [rstate[0], list(rstate[1]), rstate[2]]
+                     }
+
+        #Write a new file and replace the old one, a crash never leaves half a checkpoint
+        tmp = self.checkpoint_file() + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(checkpoint, f)
+            os.replace(tmp, self.checkpoint_file())
+        except (OSError, TypeError, ValueError) as e:
+            self.log("CHECKPOINT FAILED:", repr(e))
+            return
+        self.log("CHECKPOINT saved for loop", self.counter["test_loop"])
+
+    def checkpoint_read(self):
+        """
+        Loads the checkpoint for --resume. The counters and the random state are restored here, the modifiers after
+        the socket is opened.
+        """
+        try:
+            with open(self.checkpoint_file(), "r") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError) as err:
+            #The log is not open yet, nothing to resume so nothing to write in it
+            print("RESUME FAILED, no usable checkpoint", self.checkpoint_file(), ":", err)
+            exit(self.retval["config failed"])
+
+        with self.counter_lock:
+            self.counter = checkpoint["counter"]
+            self.counter["test_timeouts"] = self.test_max_timeouts
+        self.test_startIdx = checkpoint["test_idx"]
+        self.seed = checkpoint["seed"]
+        rstate = checkpoint["random"]
+        self.rand.setstate((rstate[0], tuple(rstate[1]), rstate[2]))
+        return checkpoint
+
+    def checkpoint_restore(self, checkpoint):
+        self.log("RESUMING from checkpoint of", checkpoint["time"], "at loop", self.counter["test_loop"])
+        if checkpoint["sha256"] != self.test_hash:
+            self.log("WARNING: the test file changed since the checkpoint was saved!")
+
+        self.opt_RunTriggers = checkpoint["opt_RunTriggers"]
+        self.opt_IgnoreStates = checkpoint["opt_IgnoreStates"]
+        self.opt_RandomExec = checkpoint["opt_RandomExec"]
+
+    def status_open(self):
+        """
+        Creates the status file for this test and maps it in memory
+        """
+        if self.status_dir is None:
+            return
+        try:
+            os.makedirs(self.status_dir, exist_ok=True)
+            self.status_file = os.path.join(self.status_dir, self.name + "_" + str(os.getpid()) + ".status")
+            with open(self.status_file, "wb") as f:
+                f.write(b"\0" * STATUS_SIZE)
+            with open(self.status_file, "r+b") as f:
+                self.status_map = mmap.mmap(f.fileno(), STATUS_SIZE)
+        except OSError as e:
+            self.log("Could not create status file:", e)
+            self.status_map = None
+            return
+        self.status_sequence = 0
+        self.status_lock = threading.Lock()
+        self.status_write()
+
+    def status_write(self):
+        """
+        Publishes the status of the test in the memory mapped file. The sequence is odd while writing and it is made
+        even again only after the record, so readers can retry if they catch a half written record.
+        """
+        if self.status_map is None:
+            return
+
+        snapshot = self.counter_snapshot()
+        counters = ",".join([str(elem) + "=" + str(snapshot[elem]) for elem in snapshot])
+        with self.status_lock:
+            self.status_sequence += 1
+            struct.pack_into("<4sI", self.status_map, 0, STATUS_MAGIC, self.status_sequence)
+            struct.pack_into(STATUS_FORMAT, self.status_map, 0, STATUS_MAGIC, self.status_sequence, os.getpid(),
+                             snapshot["test_loop"], snapshot["test_timeouts"],
+                             self.status["started"], time.time(), self.status["transition"],
+                             self.name.encode(errors="replace"),
+                             str(self.status["required"]).encode(errors="replace"),
+                             str(self.status["last"]).encode(errors="replace"),
+                             self.status["result"].encode(errors="replace"),
+                             counters.encode(errors="replace"))
+            self.status_sequence += 1
+            struct.pack_into("<4sI", self.status_map, 0, STATUS_MAGIC, self.status_sequence)
+
+    def status_close(self):
+        if self.status_map is None:
+            return
+        self.status_map.close()
+        self.status_map = None
+        try:
+            os.remove(self.status_file)
+        except OSError:
+            pass
+
     def logNoPrint(self, *args):
         outtext = ""
         for elem in args:
@@ -849,13 +3326,27 @@ class Overwatcher():
             outtext += " "
 
         try:
-            self.file_test.write(str(datetime.datetime.now()) + ' - ' + outtext + "\n")
+            with self.file_test.lock:
+                self.file_test.write(str(self.clock.now()) + ' - ' + outtext + "\n")
+                if self.logRotateSize != 0 and self.file_test.size >= self.logRotateSize * 1024 * 1024:
+                    self.log_rotate()
             return outtext
         except ValueError:
             return ""
 
+    def log_rotate(self):
+        """
+        Starts a new segment of the results log, with the test header so each segment can be read on its own
+        NOTE: the caller must hold the lock of the log
+        """
+        old = self.file_test.path()
+        self.file_test.rotate()
+        self.print_header()
+        self.file_test.write(str(self.clock.now()) + ' - +++> LOG CONTINUED FROM ' + old + " AT LOOP " +
+                             str(self.counter["test_loop"]) + "\n")
+
     def log(self, *args):
-        print(str(datetime.datetime.now()), self.logNoPrint("+++>", *args))
+        print(str(self.clock.now()), self.logNoPrint("+++>", *args))
 
     def print_test(self):
         ## First let's check the test. This is here to also handle the case
@@ -875,8 +3366,16 @@ class Overwatcher():
             input("\n\nTest should be checked before running!")
             input("Press CTRL-C to stop or ENTER to continue!")
 
+        self.print_header()
+
+    def print_header(self):
+        """
+        Test description at the start of the log, written again at the start of each log segment
+        """
         self.file_test.write(self.name + "\n\n")
         self.file_test.write(self.full_name + "\n\n")
+        if self.test_hash is not None:
+            self.file_test.write("sha256 - " + self.test_hash + "\n")
         for elem in self.info:
             if elem == "version":
                 self.file_test.write(elem + " - " + str(self.info[elem][0]) + "\n")
@@ -899,34 +3398,259 @@ class Overwatcher():
         self.file_test.write(str(self.user_inp) + "\n")
         self.file_test.write("ACTIONS:\n")
         self.file_test.write(str(self.actions) + "\n")
+        self.file_test.write("INTERVALS:\n")
+        self.file_test.write(str(self.intervals) + "\n")
+        self.file_test.write("CHANNELS:\n")
+        self.file_test.write(str(self.channels_cfg) + "\n")
 
         self.file_test.write("RUN TRIGGERS=" + str(self.opt_RunTriggers) + "\n")
         self.file_test.write("IGNORE STATES=" + str(self.opt_IgnoreStates) + "\n")
+        self.file_test.write("RANDOM SEED=" + str(self.seed) + "\n")
+        self.file_test.write("CLOCK=" + type(self.clock).__name__ + "\n")
+        if self.adaptiveTimeout is True:
+            self.file_test.write("WATCHDOG PROFILE=" + str(self.adaptive_profile) + "\n")
 
         self.file_test.write("\n\nTEST START:\n\n")
 
+    def profile_write(self):
+        """
+        Stops the profiling, logs the time used by each thread and writes the profile files next to the log
+        """
+        if self.mainProfile is not None:
+            self.mainProfile.disable()
+            self.profiler.addProfile(self.mainProfile)
+        self.profiler.stop()
+
+        for name, times in sorted(self.profiler.threadTimes().items()):
+            self.log("PROFILE thread", name, "cpu", round(times[0], 3), "s, wall", round(times[1], 3), "s")
+
+        self.profiler.write(self.name)
+        if self.profileCalls is True:
+            self.log("PROFILE written to", self.name + "_profile.pstats", "and", self.name + "_profile.folded")
+        else:
+            self.log("PROFILE written to", self.name + "_profile.folded")
+        self.profiler = None
+
     def cleanAll(self):
+        """
+        Stops the test. All sleeps, connects and timers are cancelled through the clock. Threads still running after
+        shutdownTimeout seconds are logged and abandoned (they are daemons), so the result is returned in time.
+        """
         print(self.run)
-        for elem in self.run:
+        for elem in list(self.run):
             self.run[elem] = False
             print("Ended", elem)
 
+        self.clock.cancel()
+        self.mainTimer = self.timer_stopTimer(self.mainTimer)
+
         self.queue_state.put(None)
         self.queue_serread.put(None)
         self.queue_serwrite.put(None)
+        for state in self.queue_triggers:
+            self.queue_triggers[state].put(None)
+        for name in self.channels:
+            self.channels[name].queue_serread.put(None)
+            self.channels[name].queue_serwrite.put(None)
+        try:
+            self.queue_signatures.put_nowait(None)
+        except queue.Full:
+            pass #it also stops on the run flag
 
         print(self.th)
         #NOTE: result watcher is not in list!
-        for thread in self.th:
+        deadline = time.monotonic() + self.shutdownTimeout
+        for thread in list(self.th):
             print("Joining with", thread)
-            self.th[thread].join()
-            print("Joined with", thread)
+            self.th[thread].join(max(deadline - time.monotonic(), 0))
+            if self.th[thread].is_alive():
+                frame = sys._current_frames().get(self.th[thread].ident)
+                where = ""
+                if frame is not None:
+                    where = traceback.format_stack(frame)[-1].strip().replace("\n", " ")
+                self.log("SHUTDOWN thread", thread, "did not stop, abandoned. It is at", where)
+            else:
+                print("Joined with", thread)
+
+        self.capture_stop("test ended")
+        self.intervals_report()
+        self.signatures_report()
+        self.load_report()
+        self.results_end()
+
+        if self.profiler is not None:
+            self.profile_write()
+
+        self.status_close()
 
         print("CLOSING FILE")
         self.file_test.close()
         print("CLOSED FILE")
 
+def status_read(path):
+    """
+    Reads a status record, returns None if it is not valid. The sequence is read before and after the record, the
+    record is only used if both are the same even number (nothing was written in between).
+    """
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return None
+    with f:
+        for retry in range(10):
+            head = os.pread(f.fileno(), 8, 0)
+            raw = os.pread(f.fileno(), STATUS_SIZE, 0)
+            tail = os.pread(f.fileno(), 8, 0)
+            if len(head) != 8 or len(raw) != STATUS_SIZE:
+                return None
+            magic, sequence = struct.unpack("<4sI", head)
+            if magic != STATUS_MAGIC:
+                return None
+            if sequence % 2 == 1 or tail != head:
+                #Being written, try again
+                time.sleep(0.001)
+                continue
+            fields = struct.unpack(STATUS_FORMAT, raw)
+            break
+        else:
+            return None
+
+    names = ["magic", "sequence", "pid", "loop", "timeouts", "started", "updated", "transition", "name",
+             "required", "last", "result", "counters"]
+    status = dict(zip(names, fields))
+    for elem in ["name", "required", "last", "result", "counters"]:
+        status[elem] = status[elem].rstrip(b"\0").decode(errors="replace")
+    return status
+
+def status_top(directory, interval, once=False):
+    """
+    "overwatcher top": displays the status of all tests running on this PC
+    """
+    header = "%-8s %-20s %6s %4s %-18s %-18s %8s %-8s %s" % ("PID", "TEST", "LOOP", "TO", "REQUIRED", "LAST SEEN",
+                                                           "SINCE(s)", "RESULT", "COUNTS")
+    while True:
+        lines = []
+        now = time.time()
+        for path in sorted(glob.glob(os.path.join(directory, "*.status"))):
+            status = status_read(path)
+            if status is None:
+                continue
+            try:
+                os.kill(status["pid"], 0)
+                result = status["result"]
+            except ProcessLookupError:
+                result = "DEAD"
+            except PermissionError:
+                result = status["result"]
+
+            counts = ",".join([elem for elem in status["counters"].split(",")
+                               if not elem.startswith("test_")])
+            lines.append("%-8d %-20s %6d %4d %-18s %-18s %8d %-8s %s" % (status["pid"], status["name"][:20],
+                         status["loop"], status["timeouts"], status["required"][:18], status["last"][:18],
+                         now - status["transition"], result, counts))
+
+        if once is False:
+            print("\x1b[H\x1b[2J", end="") #clear screen
+        print(time.strftime("%Y-%m-%d %H:%M:%S"), "-", len(lines), "tests in", directory)
+        print(header)
+        for line in lines:
+            print(line)
+
+        if once is True:
+            break
+        time.sleep(interval)
+
+def results_query(path, test=None, device=None, last=20, threshold=10.0):
+    """
+    "overwatcher results": the last runs in the results database and, per test and device, how each version did
+    compared with the version before it. A change worse than threshold percent is marked as a REGRESSION.
+    """
+    if not os.path.exists(path):
+        print("No results database", path)
+        return 1
+    db = sqlite3.connect(path, timeout=60)
+    db.executescript(RESULTS_SCHEMA)
+
+    where = []
+    params = []
+    if test is not None:
+        where.append("test = ?")
+        params.append(test)
+    if device is not None:
+        where.append("device = ?")
+        params.append(device)
+    where = (" WHERE " + " AND ".join(where)) if len(where) != 0 else ""
+
+    print("%-32s %-20s %-20s %-16s %-19s %-8s %6s %4s" % ("RUN", "TEST", "DEVICE", "VERSION", "STARTED", "RESULT",
+                                                         "LOOPS", "TO"))
+    rows = db.execute("SELECT id, test, device, version, started, result, loops, timeouts FROM runs" + where +
+                      " ORDER BY started DESC LIMIT ?", params + [last]).fetchall()
+    for row in reversed(rows):
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row[4])) if row[4] is not None else "-"
+        print("%-32s %-20s %-20s %-16s %-19s %-8s %6s %4s" % (row[0], str(row[1])[:20], str(row[2])[:20],
+              str(row[3])[:16], started, row[5] or "RUNNING", row[6] if row[6] is not None else "-",
+              row[7] if row[7] is not None else "-"))
+
+    #Versions in the order they were first tested
+    stats = db.execute("SELECT runs.test, runs.device, runs.version, MIN(runs.started), COUNT(DISTINCT runs.id), "
+                       "COUNT(DISTINCT CASE WHEN runs.result = 'ok' THEN runs.id END), "
+                       "(SELECT AVG(loops.duration) FROM loops JOIN runs AS r ON loops.run = r.id WHERE "
+                       "r.test = runs.test AND r.device = runs.device AND r.version = runs.version), "
+                       "SUM(runs.timeouts), SUM(runs.loops) FROM runs" + where +
+                       " GROUP BY runs.test, runs.device, runs.version ORDER BY runs.test, runs.device, "
+                       "MIN(runs.started)", params).fetchall()
+    db.close()
+
+    print()
+    print("%-20s %-20s %-16s %5s %6s %12s %8s  %s" % ("TEST", "DEVICE", "VERSION", "RUNS", "OK%", "LOOP MEAN(s)",
+                                                     "TO/LOOP", "CHANGE"))
+    previous = None
+    for row in stats:
+        test_name, dev, version, first, runs, ok, duration, timeouts, loops = row
+        okRate = 100.0 * ok / runs
+        perLoop = (timeouts or 0) / loops if loops else None
+
+        change = []
+        if previous is not None and previous[0] == (test_name, dev):
+            old = previous[1]
+            if old["ok"] - okRate > threshold:
+                change.append("ok% " + format(okRate - old["ok"], "+.1f"))
+            if duration is not None and old["duration"]:
+                diff = (duration - old["duration"]) * 100.0 / old["duration"]
+                if diff > threshold:
+                    change.append("loop " + format(diff, "+.1f") + "%")
+            if perLoop is not None and old["perLoop"] is not None and perLoop > old["perLoop"] and \
+                    (old["perLoop"] == 0 or (perLoop - old["perLoop"]) * 100.0 / old["perLoop"] > threshold):
+                change.append("timeouts/loop " + format(old["perLoop"], ".2f") + " -> " + format(perLoop, ".2f"))
+        previous = ((test_name, dev), {"ok": okRate, "duration": duration, "perLoop": perLoop})
+
+        print("%-20s %-20s %-16s %5d %6.1f %12s %8s  %s" % (str(test_name)[:20], str(dev)[:20], str(version)[:16],
+              runs, okRate, format(duration, ".3f") if duration is not None else "-",
+              format(perLoop, ".2f") if perLoop is not None else "-",
+              ("REGRESSION " + ", ".join(change)) if len(change) != 0 else ""))
+    return 0
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "top":
+        parser = argparse.ArgumentParser(prog="overwatcher top", description="Status of all running tests")
+        parser.add_argument('--status-dir', help='Directory with the status files', default=STATUS_DIR)
+        parser.add_argument('--interval', help='Refresh interval in seconds', type=float, default=2)
+        parser.add_argument('--once', help='Print once and exit', action='store_true')
+        args = parser.parse_args(sys.argv[2:])
+        status_top(args.status_dir, args.interval, args.once)
+        exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "results":
+        parser = argparse.ArgumentParser(prog="overwatcher results", description="Runs saved in a results database")
+        parser.add_argument('--db', help='Results database (see --results-db)', required=True)
+        parser.add_argument('--test', help='Only the runs of this test', default=None)
+        parser.add_argument('--device', help='Only the runs on this device (server:port or tty)', default=None)
+        parser.add_argument('--last', help='How many runs to list', type=int, default=20)
+        parser.add_argument('--threshold', help='Percent change between versions that is a regression',
+                type=float, default=10.0)
+        args = parser.parse_args(sys.argv[2:])
+        exit(results_query(args.db, args.test, args.device, args.last, args.threshold))
+
     parser = argparse.ArgumentParser(description="Ultra-light test framework")
 
     parser.add_argument('test', help='YAML test file to run')
@@ -938,9 +3662,48 @@ if __name__ == "__main__":
             action='store_true')
     parser.add_argument('--endr', help='Send a \r\n instead of just \n',
             action='store_true')
+    parser.add_argument('--tty', help='Use a local serial port or pty instead of ser2net (ex: /dev/ttyUSB0)',
+            default=None)
+    parser.add_argument('--baud', help='Baud rate for --tty',
+            type=int, default=115200)
+    parser.add_argument('--status-dir', help='Where to publish the live status of the test (empty to disable)',
+            default=STATUS_DIR)
+    parser.add_argument('--connect-dir', help='Lock directory shared by the tests of the PC to spread the connects '
+            '(empty to connect right away)', default=CONNECT_DIR)
+    parser.add_argument('--connect-per-host', help='Connects at the same time to one server (0 for no limit)',
+            type=int, default=4)
+    parser.add_argument('--connect-per-port', help='Connects at the same time to one server port (0 for no limit)',
+            type=int, default=1)
+    parser.add_argument('--connect-jitter', help='Random delay before each connect, in seconds',
+            type=float, default=2.0)
+    parser.add_argument('--resume', help='Continue an infinite test from its last checkpoint, skips the config',
+            action='store_true')
+    parser.add_argument('--load', help='Run the load section of the test (after the config) instead of the test',
+            action='store_true')
+    parser.add_argument('--profile', help='Sample the stacks of all threads, writes a flamegraph file next to the log',
+            action='store_true')
+    parser.add_argument('--profile-calls', help='Same as --profile, also runs cProfile in every thread and writes a '
+            'pstats file (slower)', action='store_true')
+    parser.add_argument('--virtual-time', help='Do not really sleep, run on a virtual clock (for simulated devices)',
+            action='store_true')
+    parser.add_argument('--seed', help='Seed for all random draws, to repeat a run',
+            type=int, default=None)
+    parser.add_argument('--results-db', help='SQLite file where the results of the run are added '
+            '(see "overwatcher.py results")', default=None)
 
     args = parser.parse_args()
 
-    test = Overwatcher(args.test, server=args.server, port=args.port, runAsTelnetTest=args.telnet, endr=args.endr)
+    clock = None
+    if args.virtual_time is True:
+        clock = VirtualClock()
+
+    connect = None
+    if args.connect_dir:
+        connect = ConnectScheduler(args.connect_dir, args.connect_per_host, args.connect_per_port, args.connect_jitter)
+
+    test = Overwatcher(args.test, server=args.server, port=args.port, runAsTelnetTest=args.telnet, endr=args.endr,
+                       clock=clock, seed=args.seed, tty=args.tty, baud=args.baud,
+                       profile=args.profile, profile_calls=args.profile_calls, status_dir=args.status_dir or None,
+                       resume=args.resume, load=args.load, connect=connect, results_db=args.results_db)
 
 
@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+"""
+overwatcher-report: summary of the _testresults.log files written by overwatcher.
+
+The log is read line by line (plain, gzip or zstd), so the memory used does not depend on the size of the log. Only the
+numbers needed for the statistics are kept (one value per loop or per transition).
+
+Computed:
+    - final result
+    - duration of each loop (percentiles and histogram)
+    - how many times each state was found
+    - timeouts per loop
+    - time between two named states (--between A B, can be repeated)
+
+With --compare, a second run is summarised and both are displayed side by side.
+
+NOTE: numpy is used for the statistics when it is installed, otherwise the same numbers are computed in python.
+NOTE: zstd logs need the zstandard module. A compressed log that is still being written is read up to its last
+complete frame.
+"""
+import argparse
+import array
+import datetime
+import gzip
+import io
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+LOG_SEPARATOR = b" - +++> "
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+PERCENTILES = [50, 90, 99]
+
+
+def openLog(path):
+    """
+    Opens a log in binary mode, compressed or not
+    """
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    if magic[:2] == GZIP_MAGIC:
+        return gzip.open(path, "rb")
+    if magic == ZSTD_MAGIC:
+        if zstandard is None:
+            raise SystemExit("zstandard module needed to read " + path)
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True)
+        return io.BufferedReader(raw, buffer_size=1024*1024)
+    return open(path, "rb", buffering=1024*1024)
+
+
+def percentile(values, p):
+    """
+    Percentile with linear interpolation (same as numpy's default). Also used by overwatcher, values can be a list
+    or an array.
+    """
+    if len(values) == 0:
+        return float("nan")
+    if numpy is not None:
+        return float(numpy.percentile(numpy.asarray(values, dtype=numpy.float64), p))
+
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * p / 100.0
+    low = math.floor(pos)
+    high = math.ceil(pos)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def histogram(values, bins=10):
+    """
+    Returns a list of (bin start, bin end, count)
+    """
+    if len(values) == 0:
+        return []
+    if numpy is not None:
+        counts, edges = numpy.histogram(numpy.frombuffer(values, dtype=numpy.float64), bins=bins)
+        return [(float(edges[i]), float(edges[i + 1]), int(counts[i])) for i in range(len(counts))]
+
+    low = min(values)
+    high = max(values)
+    width = (high - low) / bins
+    if width == 0:
+        return [(low, high, len(values))]
+    counts = [0] * bins
+    for val in values:
+        counts[min(int((val - low) / width), bins - 1)] += 1
+    return [(low + i * width, low + (i + 1) * width, counts[i]) for i in range(bins)]
+
+
+def summary(values):
+    """
+    Dictionary with the basic statistics of a list of values
+    """
+    ret = {"count": len(values)}
+    if len(values) == 0:
+        return ret
+    ret["min"] = min(values)
+    ret["mean"] = sum(values) / len(values)
+    for p in PERCENTILES:
+        ret["p" + str(p)] = percentile(values, p)
+    ret["max"] = max(values)
+    return ret
+
+
+class RunReport():
+    """
+    Statistics for one run. The run can be split in more files (rotated logs), give them in order.
+    """
+    def __init__(self, paths, between=None):
+        self.paths = paths
+        self.result = None
+        self.loops = 0
+        self.loopDurations = array.array("d")
+        self.loopTimeouts = array.array("l")
+        self.states = {}
+        self.timeouts = 0
+
+        #Pairs of states to time
+        self.between = {}
+        self.betweenStart = {}
+        for pair in (between or []):
+            self.between[tuple(pair)] = array.array("d")
+            self.betweenStart[tuple(pair)] = None
+
+        self.lastTime = None
+        self.loopStart = None
+        self.currentTimeouts = 0
+
+        for path in paths:
+            with openLog(path) as f:
+                try:
+                    self.parse(f)
+                except EOFError:
+                    #Last frame not written yet
+                    pass
+
+    def parse(self, f):
+        for line in f:
+            idx = line.find(LOG_SEPARATOR)
+            if idx < 0:
+                #Header or the rest of a multi-line message
+                if b"ENDED CONFIG!" in line:
+                    self.startLoop()
+                continue
+
+            text = line[idx + len(LOG_SEPARATOR):]
+            #Speed things up a bit, device output is most of the log
+            if text.startswith(b"DEV ") or text.startswith(b"SENT "):
+                continue
+
+            if text.startswith(b"FOUND ") and not text.startswith(b"FOUND MODIFIER"):
+                stamp = self.stamp(line[:idx])
+                state = text.split(b" ", 2)[1].decode(errors="replace")
+                self.states[state] = self.states.get(state, 0) + 1
+                self.timeBetween(state, stamp)
+            elif text.startswith(b"GOT TO LOOP"):
+                self.stamp(line[:idx])
+                self.endLoop()
+                self.startLoop()
+            elif text.startswith(b"GOT A TIMEOUT"):
+                self.timeouts += 1
+                self.currentTimeouts += 1
+            elif text.startswith(b"GOT RESULT:"):
+                self.stamp(line[:idx])
+                self.result = text.split(b":", 1)[1].strip().decode(errors="replace")
+                self.endLoop()
+            elif len(text.strip()) == 0:
+                #Multi-line messages (like the config markers) start with an empty line
+                self.stamp(line[:idx])
+
+    def stamp(self, raw):
+        try:
+            self.lastTime = datetime.datetime.fromisoformat(raw.decode())
+        except ValueError:
+            pass
+        return self.lastTime
+
+    def startLoop(self):
+        self.loopStart = self.lastTime
+        self.currentTimeouts = 0
+
+    def endLoop(self):
+        if self.loopStart is None or self.lastTime is None:
+            return
+        self.loops += 1
+        self.loopDurations.append((self.lastTime - self.loopStart).total_seconds())
+        self.loopTimeouts.append(self.currentTimeouts)
+        self.loopStart = None
+
+    def timeBetween(self, state, stamp):
+        if stamp is None:
+            return
+        for pair in self.between:
+            if state == pair[0]:
+                self.betweenStart[pair] = stamp
+            elif state == pair[1] and self.betweenStart[pair] is not None:
+                self.between[pair].append((stamp - self.betweenStart[pair]).total_seconds())
+                self.betweenStart[pair] = None
+
+    def values(self):
+        """
+        Flat dictionary of everything that can be compared between runs
+        """
+        ret = {}
+        ret["result"] = self.result
+        ret["loops"] = self.loops
+        ret["timeouts"] = self.timeouts
+        ret["loops with timeouts"] = sum(1 for t in self.loopTimeouts if t != 0)
+        ret["max timeouts in a loop"] = max(self.loopTimeouts, default=0)
+        for key, val in summary(self.loopDurations).items():
+            ret["loop duration " + key] = val
+        for pair in self.between:
+            for key, val in summary(self.between[pair]).items():
+                ret[pair[0] + " -> " + pair[1] + " " + key] = val
+        for state in sorted(self.states):
+            ret["state " + state] = self.states[state]
+        return ret
+
+
+def formatValue(val):
+    if isinstance(val, float):
+        return "%.3f" % val
+    return str(val)
+
+
+def printReport(report):
+    print("RUN:", ", ".join(report.paths))
+    for key, val in report.values().items():
+        print("    %-40s %s" % (key, formatValue(val)))
+
+    print("    loop duration histogram (seconds):")
+    for start, end, count in histogram(report.loopDurations):
+        print("        %10.1f - %10.1f %8d %s" % (start, end, count, "#" * min(count, 60)))
+
+
+def printCompare(first, second):
+    firstValues = first.values()
+    secondValues = second.values()
+    print("%-40s %15s %15s %10s" % ("", "RUN 1", "RUN 2", "CHANGE"))
+    for key in list(firstValues) + [k for k in secondValues if k not in firstValues]:
+        val1 = firstValues.get(key)
+        val2 = secondValues.get(key)
+        change = ""
+        if isinstance(val1, (int, float)) and isinstance(val2, (int, float)) and val1 != 0:
+            change = "%+.1f%%" % ((val2 - val1) * 100.0 / val1)
+        print("%-40s %15s %15s %10s" % (key, formatValue(val1), formatValue(val2), change))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summary of overwatcher results logs")
+
+    parser.add_argument('logs', nargs='+', help='Results log(s) of a run, in order (plain, gzip or zstd)')
+    parser.add_argument('--compare', nargs='+', help='Results log(s) of a second run to compare with',
+            default=None)
+    parser.add_argument('--between', nargs=2, action='append', metavar=('START', 'END'),
+            help='Time between two states, can be given more than once', default=None)
+
+    args = parser.parse_args()
+
+    report = RunReport(args.logs, between=args.between)
+    if args.compare is None:
+        printReport(report)
+    else:
+        printCompare(report, RunReport(args.compare, between=args.between))
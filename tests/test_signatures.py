@@ -0,0 +1,79 @@
+"""
+Failure signature matching: the trie of the plain text patterns and the merged regular expressions.
+"""
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from overwatcher import SignatureScanner, trie_regex
+
+
+class TrieRegexTest(unittest.TestCase):
+    def test_words(self):
+        r = re.compile(trie_regex(["panic", "oops", "BUG"]))
+        self.assertEqual(r.findall("oops, BUG and panic"), ["oops", "BUG", "panic"])
+        self.assertIsNone(r.search("all good"))
+
+    def test_prefixes(self):
+        #The longest word wins, the shorter ones still match alone
+        r = re.compile(trie_regex(["err", "error", "errors"]))
+        self.assertEqual(r.match("errors").group(0), "errors")
+        self.assertEqual(r.match("error:").group(0), "error")
+        self.assertEqual(r.match("err.").group(0), "err")
+
+    def test_special_characters(self):
+        r = re.compile(trie_regex(["a.b", "(x)"]))
+        self.assertIsNone(r.search("aXb"))
+        self.assertEqual(r.search("see (x)").group(0), "(x)")
+
+
+class SignatureScannerTest(unittest.TestCase):
+    def test_literals(self):
+        scanner = SignatureScanner({"panic": "Kernel panic", "oops": {"pattern": "Oops", "severity": "critical"}})
+        self.assertEqual(len(scanner), 2)
+        self.assertEqual(scanner.match("Kernel panic - not syncing"), ["panic"])
+        self.assertEqual(scanner.match("Oops: 0000"), ["oops"])
+        self.assertEqual(scanner.match("all good"), [])
+
+    def test_overlapping_literals(self):
+        #One signature starts inside another one
+        scanner = SignatureScanner({"a": "abc", "b": "bcd"})
+        self.assertEqual(sorted(scanner.match("xabcdx")), ["a", "b"])
+
+    def test_prefix_literals(self):
+        scanner = SignatureScanner({"short": "error", "long": "error 42", "same": "error"})
+        self.assertEqual(sorted(scanner.match("error 42")), ["long", "same", "short"])
+        self.assertEqual(sorted(scanner.match("error 4")), ["same", "short"])
+
+    def test_regex(self):
+        scanner = SignatureScanner({"rcu": {"pattern": r"rcu_\w+ detected stall", "regex": True},
+                                    "lit": "rcu_sched"})
+        self.assertEqual(sorted(scanner.match("rcu_sched detected stall")), ["lit", "rcu"])
+        self.assertEqual(scanner.match("rcu_sched ok"), ["lit"])
+
+    def test_regex_backreference(self):
+        scanner = SignatureScanner({"first": {"pattern": r"(a)x", "regex": True},
+                                    "double": {"pattern": r"(b)\1", "regex": True}})
+        self.assertEqual(scanner.match("bb"), ["double"])
+        self.assertEqual(scanner.match("ax"), ["first"])
+        self.assertEqual(scanner.match("ba"), [])
+
+    def test_regex_flags(self):
+        scanner = SignatureScanner({"panic": {"pattern": "(?i)panic", "regex": True},
+                                    "oops": {"pattern": "Oops", "regex": True}})
+        self.assertEqual(scanner.match("KERNEL PANIC"), ["panic"])
+        self.assertEqual(scanner.match("oops"), [])
+        self.assertEqual(scanner.match("Oops"), ["oops"])
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            SignatureScanner({"bad": {"pattern": "(unclosed", "regex": True}})
+        with self.assertRaises(ValueError):
+            SignatureScanner({"bad": {"pattern": "x", "severity": "fatal"}})
+
+
+if __name__ == "__main__":
+    unittest.main()
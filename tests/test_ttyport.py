@@ -0,0 +1,60 @@
+"""
+TtyPort on a pty pair: the test side opens the slave like a serial port, the master plays the device.
+"""
+import os
+import pty
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from overwatcher import TtyPort
+
+
+class TtyPortTest(unittest.TestCase):
+    def setUp(self):
+        self.master, slave = pty.openpty()
+        self.device = os.ttyname(slave)
+        os.close(slave)
+        self.port = TtyPort(self.device, 115200)
+
+    def tearDown(self):
+        self.port.close()
+        os.close(self.master)
+
+    def test_roundtrip(self):
+        self.port.settimeout(1)
+        self.port.sendall(b"help\n")
+        self.assertEqual(os.read(self.master, 100), b"help\n")
+
+        os.write(self.master, b"nn# ")
+        self.assertEqual(self.port.recv(100), b"nn# ")
+
+    def test_raw_mode(self):
+        #No echo or line editing from the tty itself, the device does all of it
+        self.port.settimeout(0.2)
+        os.write(self.master, b"a\x7fb\r")
+        self.assertEqual(self.port.recv(100), b"a\x7fb\r")
+        with self.assertRaises(socket.timeout):
+            self.port.recv(100)
+
+    def test_timeout(self):
+        self.port.settimeout(0.1)
+        with self.assertRaises(socket.timeout):
+            self.port.recv(1)
+
+    def test_closed(self):
+        self.port.close()
+        with self.assertRaises(OSError):
+            self.port.recv(1)
+        with self.assertRaises(OSError):
+            self.port.sendall(b"x")
+
+    def test_baud(self):
+        with self.assertRaises(ValueError):
+            TtyPort(self.device, 12345)
+
+
+if __name__ == "__main__":
+    unittest.main()
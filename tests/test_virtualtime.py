@@ -0,0 +1,165 @@
+"""
+Infinite test against a simulated device on a VirtualClock (--virtual-time): no timeouts, and the same seed gives the
+same test flow.
+"""
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+OVERWATCHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "overwatcher.py")
+
+#"print help" is not a prompt and it is seen while the test waits for the prompt of help
+TEST = """
+info:
+    purpose: virtual time
+    version:
+        - 1, x
+    overwatcher revision required: 20181012
+markers:
+    "U-Boot SPL": uboot_begin
+    "Hit any key to stop": uboot_enter
+    "nn#": uboot_prompt
+    "print help": help_out
+prompts:
+    - uboot_prompt
+triggers:
+    uboot_begin: [ WATCH_STATES, TRIGGER_START ]
+    uboot_enter: [ "" ]
+actions:
+    print_stuff: [ help, printenv ]
+    reboot: [ IGNORE_STATES, TRIGGER_STOP, reset ]
+initconfig:
+    - uboot_prompt
+test:
+    - print_stuff
+    - SLEEP_RANDOM
+    - reboot
+    - uboot_begin
+    - uboot_enter
+    - uboot_prompt
+options:
+    timeout: 10
+    infiniteTest: True
+    sleep_min: 20
+    sleep_max: 40
+"""
+
+LOOPS = 3
+BOOT_DELAY = 0.3 #seconds, real time, less than the read timeout of the reader (a silent device moves the clock)
+
+#Lines of the test thread, the ones of the reader and the state watcher can be interleaved differently
+FLOW = re.compile(r"Looking for|MOVED TO STATE|IGNORED STATE|RUNNING ACTIONS|Found prompt|Zzzz|WAKE UP|GOT TO LOOP|"
+                  r"TIMEOUT|GOT RESULT")
+
+
+class SimulatedDevice():
+    """
+    Answers like a bootloader: echo, some output and a prompt for each command, a boot for reset
+    """
+    def __init__(self):
+        self.server = socket.socket()
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(5)
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, addr = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        data = b""
+        with conn:
+            while True:
+                try:
+                    chunk = conn.recv(1024)
+                except OSError:
+                    return
+                if not chunk:
+                    return
+                data += chunk
+                while b"\n" in data:
+                    line, data = data.split(b"\n", 1)
+                    line = line.strip()
+                    out = line + b"\r\n"
+                    if line == b"reset":
+                        #Like a real board, the boot starts after the reset command was handled
+                        conn.sendall(out)
+                        time.sleep(BOOT_DELAY)
+                        out = b"U-Boot SPL\r\nHit any key to stop\r\n"
+                    else:
+                        if line == b"help":
+                            out += b"help - print help\r\nprintenv - env\r\n"
+                        elif line == b"printenv":
+                            out += b"var0=val\r\nvar1=val\r\n"
+                        out += b"nn# "
+                    conn.sendall(out)
+
+    def close(self):
+        self.server.close()
+
+
+class VirtualTimeTest(unittest.TestCase):
+    def setUp(self):
+        self.device = SimulatedDevice()
+        self.dirs = []
+
+    def tearDown(self):
+        self.device.close()
+        for path in self.dirs:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def run_test(self, seed):
+        """
+        Runs the test until LOOPS loops are done, returns the lines of the test flow
+        """
+        path = tempfile.mkdtemp()
+        self.dirs.append(path)
+        with open(os.path.join(path, "vt.yml"), "w") as f:
+            f.write(TEST)
+
+        proc = subprocess.Popen([sys.executable, OVERWATCHER, "vt.yml", "--server", "127.0.0.1",
+                                 "--port", str(self.device.port), "--virtual-time", "--seed", str(seed),
+                                 "--connect-dir", "", "--status-dir", ""],
+                                cwd=path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        log = os.path.join(path, "vt_testresults.log")
+        end = "GOT TO LOOP..... " + str(LOOPS + 1)
+        text = ""
+        try:
+            deadline = time.monotonic() + 60
+            while end not in text and proc.poll() is None and time.monotonic() < deadline:
+                time.sleep(0.2)
+                if os.path.exists(log):
+                    with open(log) as f:
+                        text = f.read()
+        finally:
+            proc.kill()
+            proc.wait()
+
+        self.assertIn(end, text)
+        flow = [line for line in text[:text.index(end)].splitlines() if FLOW.search(line)]
+        return flow
+
+    def test_infinite(self):
+        first = self.run_test(1)
+        second = self.run_test(1)
+
+        self.assertEqual([line for line in first if "TIMEOUT" in line], [])
+        self.assertEqual(len([line for line in first if "GOT TO LOOP" in line]), LOOPS - 1)
+        self.assertEqual(first, second)
+
+
+if __name__ == "__main__":
+    unittest.main()